@@ -0,0 +1,156 @@
+"""
+Onelinerizes or decompiles every target function in a source tree using a pool of processes
+
+Usage:
+    python batch.py SOURCE_DIR OUTPUT_DIR [--mode oneline|decompile] [--function main] [--workers N]
+                    [--cache PATH] [--cache-size MB] [--fold] [--minify]
+
+Every SOURCE_DIR/path/file.py gets OUTPUT_DIR/path/file.py with the results, files which failed
+are listed in OUTPUT_DIR/errors.json. Sources are only compiled, never executed
+"""
+import argparse
+import dis
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import clean_main
+import decompiler
+import minify
+from cache import ResultCache, cached
+
+CACHE = dis.opmap['CACHE']
+
+MODES = {
+    'oneline': clean_main.onelinerize,
+    'decompile': decompiler.decompile,
+}
+
+_caches: dict[str, ResultCache] = {}  # one connection per worker process
+
+
+def get_generate(mode: str, cache_path: str = None, cache_size: int = None):
+    if cache_path is None:
+        return MODES[mode], None
+    if cache_path not in _caches:
+        _caches[cache_path] = ResultCache(cache_path, cache_size)
+    cache = _caches[cache_path]
+    return cached(MODES[mode], cache), cache
+
+
+def find_functions(code, name: str):
+    """
+    Yields code objects of all functions with the name, including nested ones
+    """
+    for const in code.co_consts:
+        if hasattr(const, 'co_code'):
+            if const.co_name == name:
+                yield const
+            yield from find_functions(const, name)
+
+
+def process_file(source: Path, output: Path, mode: str, function: str,
+                 cache_path: str = None, cache_size: int = None, options: dict = None, minified: bool = False) -> dict:
+    """
+    Runs in a worker process
+    :param options: keyword arguments for the emulate of the mode
+    :param minified: minify one-liners, they are not run to verify them, see minify.py for that
+    :return: report for the file
+    """
+    start = time.perf_counter()
+    report = {'file': str(source), 'functions': 0, 'instructions': 0, 'cache_hits': 0, 'cache_misses': 0,
+              'bytes_saved': 0}
+    try:
+        generate, cache = get_generate(mode, cache_path, cache_size)
+        hits, misses = (cache.hits, cache.misses) if cache else (0, 0)
+
+        code = compile(source.read_text(), str(source), 'exec')
+        results = []
+        for func in find_functions(code, function):
+            text = generate(dis.Bytecode(func), **(options or {})).rstrip('\n')
+            if minified:
+                small = minify.minify(text)
+                report['bytes_saved'] += len(text.encode()) - len(small.encode())
+                text = small
+            results.append(text)
+            report['functions'] += 1
+            # code units without the inline caches, the same count as dis gives, decoding would defeat the cache
+            report['instructions'] += len(func.co_code) // 2 - func.co_code[::2].count(CACHE)
+
+        if cache:
+            report['cache_hits'] = cache.hits - hits
+            report['cache_misses'] = cache.misses - misses
+
+        if results:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with output.open('w') as file:
+                file.writelines(result + '\n' for result in results)
+    except Exception as e:
+        report['error'] = f'{type(e).__name__}: {e}'
+    report['seconds'] = time.perf_counter() - start
+    return report
+
+
+def run(source_dir: Path, output_dir: Path, mode: str = 'oneline', function: str = 'main',
+        workers: int = None, cache_path: str = None, cache_size: int = 64 * 1024 * 1024,
+        options: dict = None, minified: bool = False) -> list[dict]:
+    sources = sorted(source_dir.rglob('*.py'))
+    outputs = [output_dir / path.relative_to(source_dir) for path in sources]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(sources) // ((workers or os.cpu_count() or 1) * 4))
+        n = len(sources)
+        reports = list(pool.map(process_file, sources, outputs, [mode] * n, [function] * n,
+                                [cache_path] * n, [cache_size] * n, [options] * n, [minified] * n,
+                                chunksize=chunksize))
+
+    errors = [report for report in reports if 'error' in report]
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / 'errors.json').write_text(json.dumps(errors, indent=2))
+    return reports
+
+
+def summary(reports: list[dict], seconds: float) -> str:
+    failed = sum('error' in report for report in reports)
+    functions = sum(report['functions'] for report in reports)
+    instructions = sum(report['instructions'] for report in reports)
+    hits = sum(report['cache_hits'] for report in reports)
+    misses = sum(report['cache_misses'] for report in reports)
+    saved = sum(report['bytes_saved'] for report in reports)
+    return (
+        f'{len(reports)} files ({failed} failed), {functions} functions, {instructions} instructions '
+        f'in {seconds:.2f}s: {len(reports) / seconds:.1f} files/s, {instructions / seconds:,.0f} instructions/s'
+        + (f', cache {hits} hits / {misses} misses' if hits or misses else '')
+        + (f', minified {saved} bytes' if saved else '')
+    )
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Onelinerize or decompile every function in a source tree')
+    parser.add_argument('source', type=Path)
+    parser.add_argument('output', type=Path)
+    parser.add_argument('--mode', choices=MODES, default='oneline')
+    parser.add_argument('--function', default='main', help='name of the functions to process')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes, all cores by default')
+    parser.add_argument('--cache', help='sqlite file to keep results of unchanged functions between runs')
+    parser.add_argument('--cache-size', type=int, default=64, help='cache size limit in MiB')
+    parser.add_argument('--fold', action='store_true', help='evaluate constant expressions and drop dead branches')
+    parser.add_argument('--minify', action='store_true', help='minify one-liners, only for --mode oneline')
+    args = parser.parse_args(argv)
+    if args.minify and args.mode != 'oneline':
+        parser.error('--minify works only with --mode oneline')
+
+    start = time.perf_counter()
+    reports = run(args.source, args.output, args.mode, args.function, args.workers,
+                  args.cache, args.cache_size * 1024 * 1024, {'fold': True} if args.fold else None,
+                  args.minify)
+    for report in reports:
+        if 'error' in report:
+            print(f'{report["file"]}: {report["error"]}')
+    print(summary(reports, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Compares native execution, virtual_machine.emulate and the exec'd onelinerizer output
+on the samples and any other programs passed on the command line.
+Reports wall time, instructions per second and peak memory as a table and optionally as JSON.
+Instructions are the ones executed by the VM, for native and one-liner runs it's the same
+amount of work, so the numbers can be compared between back ends
+
+Run from the repository root:
+    python -m benchmarks.backends [program.py | directory ...] [--json results.json] [--repeat 5]
+"""
+import argparse
+import dis
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import virtual_machine
+from benchmarks.common import count_instructions, generate_oneliner, isolated_io, load_main, sample_paths
+
+
+def backends(func) -> dict:
+    """
+    Zero-argument callables running the program on every back end, code generation
+    and decoding are not part of the run. Back ends which can't handle the program get the exception instead
+    """
+    program = virtual_machine.decode(func)
+    runs = {
+        'native': func,
+        'vm': lambda: virtual_machine.run(program, virtual_machine.Frame.new(func)),
+    }
+    try:
+        oneliner = compile(generate_oneliner(func), '<oneliner>', 'exec')
+        runs['oneliner'] = lambda: exec(oneliner, {})
+    except NotImplementedError as e:
+        runs['oneliner'] = e  # nested functions and other things the onelinerizer doesn't support
+    return runs
+
+
+def wall_time(run, repeat: int) -> float:
+    with isolated_io():
+        run()  # warm up
+    best = float('inf')
+    for _ in range(repeat):
+        with isolated_io():
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(run) -> int:
+    # separate run, tracemalloc slows everything down too much to time it at the same time
+    with isolated_io():
+        tracemalloc.start()
+        try:
+            run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+
+def bench_program(path: Path, repeat: int) -> list[dict]:
+    results = []
+    try:
+        func = load_main(path)
+        with isolated_io():
+            instructions = count_instructions(dis.Bytecode(func))
+        runs = backends(func)
+    except Exception as e:
+        return [{'program': str(path), 'backend': None, 'error': f'{type(e).__name__}: {e}'}]
+
+    for backend, run in runs.items():
+        result = {'program': str(path), 'backend': backend, 'instructions': instructions}
+        if isinstance(run, Exception):
+            result['error'] = f'{type(run).__name__}: {run}'
+            results.append(result)
+            continue
+        try:
+            seconds = wall_time(run, repeat)
+            result.update(seconds=seconds, ips=instructions / seconds, peak_bytes=peak_memory(run))
+        except Exception as e:
+            result['error'] = f'{type(e).__name__}: {e}'
+        results.append(result)
+    return results
+
+
+def collect(paths: list[str]) -> list[Path]:
+    if not paths:
+        return sample_paths()
+    programs = []
+    for path in map(Path, paths):
+        programs.extend(sorted(path.rglob('*.py')) if path.is_dir() else [path])
+    return programs
+
+
+def print_table(results: list[dict]):
+    print(f'{"program":<24}{"backend":<10}{"instructions":>14}{"time, s":>12}{"ips":>16}{"peak, KiB":>12}')
+    for r in results:
+        name = Path(r['program']).stem
+        if 'error' in r:
+            print(f'{name:<24}{str(r["backend"]):<10}  {r["error"]}')
+            continue
+        print(f'{name:<24}{r["backend"]:<10}{r["instructions"]:>14}{r["seconds"]:>12.5f}'
+              f'{r["ips"]:>16,.0f}{r["peak_bytes"] / 1024:>12.1f}')
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Benchmark native, VM and onelinerized execution')
+    parser.add_argument('programs', nargs='*', help='files or directories with programs defining main(), '
+                                                    'samples/ by default')
+    parser.add_argument('--json', help='write results as JSON to this file, - for stdout')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per back end, the best one is reported')
+    args = parser.parse_args(argv)
+
+    results = []
+    for path in collect(args.programs):
+        results.extend(bench_program(path, args.repeat))
+
+    if args.json == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    print_table(results)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
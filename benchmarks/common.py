@@ -0,0 +1,73 @@
+"""
+Helpers shared by the benchmarks
+"""
+import contextlib
+import dis
+import importlib.util
+import io
+import random
+import sys
+from pathlib import Path
+
+import clean_main
+import virtual_machine
+
+SAMPLES_DIR = Path(__file__).resolve().parent.parent / 'samples'
+
+# enough answers for the interactive samples, simple_game asks for a name and six guesses
+STDIN = '10\n' * 100
+
+
+def load_main(path: Path):
+    """
+    Imports the file and returns its main() function
+    """
+    spec = importlib.util.spec_from_file_location(f'bench_{path.stem}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.main
+
+
+def sample_paths() -> list[Path]:
+    return sorted(SAMPLES_DIR.glob('*.py'))
+
+
+@contextlib.contextmanager
+def isolated_io(stdin: str = STDIN):
+    """
+    Feeds stdin from a string, swallows stdout and seeds random, so every run does the same work
+    """
+    old_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
+    random.seed(0)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            yield output
+    finally:
+        sys.stdin = old_stdin
+
+
+def count_instructions(bytecode: dis.Bytecode, fuse: bool = False) -> int:
+    """
+    Number of instructions the decoded VM executes for the bytecode, including calls of emulated functions
+    :param fuse: count with superinstructions, which is the number of dispatches
+    """
+    executed = 0
+
+    def run(program: list[tuple], frame: virtual_machine.Frame):
+        nonlocal executed
+        while frame.index < len(program):
+            handler, arg = program[frame.index]
+            frame.index += 1
+            handler(frame, arg)
+            executed += 1
+
+    frame = virtual_machine.Frame.new(bytecode)
+    frame.runner = lambda function, function_frame: run(function.program, function_frame)
+    frame.fuse = fuse
+    run(virtual_machine.decode(bytecode, fuse), frame)
+    return executed
+
+
+def generate_oneliner(func, walrus: bool = True) -> str:
+    return clean_main.onelinerize(dis.Bytecode(func), walrus=walrus)
@@ -0,0 +1,85 @@
+"""
+Decompiler speed on synthetic functions made of towers of deeply nested ifs,
+with tens of thousands of instructions. Times can be saved with --json and compared against
+the next run with --baseline, e.g. before and after a change of the decompiler
+
+Run from the repository root:
+    python -m benchmarks.decompiler_nesting [--repeat 3] [--json results.json] [--baseline results.json]
+"""
+import argparse
+import dis
+import json
+import time
+from pathlib import Path
+
+import decompiler
+from ir import get_ir
+
+CASES = ((10, 100), (40, 100), (80, 100), (80, 400))  # (depth, towers)
+
+
+def synthetic_function(depth: int, towers: int):
+    lines = ['def main():', '    x = 0']
+    for _ in range(towers):
+        for level in range(depth):
+            indent = '    ' * (level + 1)
+            lines.append(f'{indent}if x < {level}:')
+            lines.append(f'{indent}    x = x + 1')
+    lines.append('    return')
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['main']
+
+
+def measure(func, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decompiler.decompile(dis.Bytecode(func))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench(repeat: int) -> list[dict]:
+    results = []
+    for depth, towers in CASES:
+        # dis.findlabels is quadratic, so the shared IR is decoded before the timer starts
+        func = synthetic_function(depth, towers)
+        instructions = len(get_ir(func).instructions)
+        results.append({'depth': depth, 'towers': towers, 'instructions': instructions,
+                        'seconds': measure(func, repeat)})
+    return results
+
+
+def print_table(results: list[dict], baseline: list[dict] = None):
+    """
+    :param baseline: results of an earlier run, cases missing from it are printed without the comparison
+    """
+    before = {(r['depth'], r['towers']): r['seconds'] for r in baseline or ()}
+    header = f'{"depth":>6}{"towers":>8}{"instructions":>14}{"time, s":>10}{"us/instruction":>16}'
+    print(header + (f'{"before, s":>11}{"speedup":>9}' if baseline else ''))
+    for r in results:
+        line = (f'{r["depth"]:>6}{r["towers"]:>8}{r["instructions"]:>14}{r["seconds"]:>10.3f}'
+                f'{r["seconds"] / r["instructions"] * 1e6:>16.2f}')
+        if (r['depth'], r['towers']) in before:
+            seconds = before[r['depth'], r['towers']]
+            line += f'{seconds:>11.3f}{seconds / r["seconds"]:>8.2f}x'
+        print(line)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Decompiler on deeply nested synthetic functions')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case, the best one is reported')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    args = parser.parse_args(argv)
+
+    results = bench(args.repeat)
+    print_table(results, json.loads(Path(args.baseline).read_text()) if args.baseline else None)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+"""
+Differential fuzzing of the back ends. Random programs made of assignments, for loops over ranges, if/else,
+arithmetic, comparisons and calls of builtins are run natively, on virtual_machine.emulate and as exec'd
+one-liners. Printed output and the type of the raised exception have to be the same everywhere, and the time
+of every back end relative to native execution is compared with the other programs of the run.
+Every mismatch and timing outlier is minimized to a small reproducer.
+
+Programs only depend on the seed and their number, so --seed 3 --only 17 brings back program 17 of the run.
+Throughput of every back end, in instructions executed by the VM per second, can be saved with --json and
+compared against the next run with --baseline, the exit code is 1 for mismatches and throughput regressions
+
+Run from the repository root:
+    python -m benchmarks.fuzz [--seed 0] [--programs 200] [--walrus] [--fold] [--inline] [--fuse]
+                              [--repeat 3] [--outlier 5] [--json results.json] [--baseline results.json]
+"""
+import argparse
+import ast
+import copy
+import dis
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import clean_main
+import virtual_machine
+from benchmarks.common import count_instructions, isolated_io
+from opcodes import BINARY_OPS
+
+BACKENDS = ('native', 'vm', 'oneliner')
+NAMES = tuple('abcdef')
+SYMBOLS = {'+': ast.Add, '-': ast.Sub, '*': ast.Mult, '/': ast.Div, '//': ast.FloorDiv, '%': ast.Mod,
+           '&': ast.BitAnd, '|': ast.BitOr, '^': ast.BitXor}
+OPERATORS = tuple(SYMBOLS[symbol] for symbol in BINARY_OPS)  # only what BINARY_OP supports
+COMPARISONS = (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Eq, ast.NotEq)
+BUILTINS = {'abs': 1, 'min': 2, 'max': 2, 'bool': 1, 'str': 1}  # name -> number of arguments
+
+# reproducers of fixed mismatches, every run checks them before the generated programs
+REPRODUCERS = (
+    # else of an if nested in an if with an else
+    "def main():\n    x = 1\n    if x:\n        if x > 5:\n            print('a')\n        else:\n"
+    "            print('b')\n    else:\n        print('c')\n    print('d')\n    return",
+    # continue two ifs deep skips the code after the outer if too
+    "def main():\n    for i in range(4):\n        if i > 0:\n            if i % 2:\n                continue\n"
+    "            print('even')\n        print('tail', i)\n    return",
+)
+# open mismatch classes as (seed, program, one-liner modes it fails in, what goes wrong), every run reports
+# whether they still fail, a fixed one goes to REPRODUCERS
+KNOWN_MISMATCHES = (
+    (0, 5, ('lambda', 'walrus'), 'comparisons inside arithmetic lose their parentheses, '
+                                 '(a >= b) % c becomes a >= b % c'),
+    (0, 11, ('lambda',), 'variables assigned in a loop body, loop variables of inner loops too, '
+                         'are lost after the loop'),
+)
+
+
+class ProgramGenerator:
+    """
+    Makes the body of main() as an ast. Variables are read only where they are assigned on every path,
+    loops only go over small ranges, so every program terminates and its numbers stay small
+    """
+
+    def __init__(self, rng: random.Random, max_depth: int = 3, max_statements: int = 6):
+        self.rng = rng
+        self.max_depth = max_depth
+        self.max_statements = max_statements
+
+    def program(self) -> ast.Module:
+        body = self.block(set(), 0)
+        body.append(ast.Return())
+        function = ast.FunctionDef('main', ast.arguments([], [], None, [], [], None, []), body, [], None)
+        return ast.fix_missing_locations(ast.Module([function], []))
+
+    def block(self, assigned: set[str], depth: int) -> list[ast.stmt]:
+        assigned = set(assigned)  # assignments inside a block may not happen
+        return [self.statement(assigned, depth) for _ in range(self.rng.randint(1, self.max_statements))]
+
+    def statement(self, assigned: set[str], depth: int) -> ast.stmt:
+        kinds = ['assign', 'assign', 'print']
+        if depth < self.max_depth:
+            kinds += ['if', 'for']
+        kind = self.rng.choice(kinds)
+
+        if kind == 'assign':
+            name = self.rng.choice(NAMES)
+            value = self.expression(assigned, depth)
+            assigned.add(name)
+            return ast.Assign([ast.Name(name, ast.Store())], value)
+        if kind == 'print':
+            args = [self.expression(assigned, depth) for _ in range(self.rng.randint(1, 2))]
+            return ast.Expr(ast.Call(ast.Name('print', ast.Load()), args, []))
+        if kind == 'if':
+            orelse = self.block(assigned, depth + 1) if self.rng.random() < 0.5 else []
+            return ast.If(self.condition(assigned, depth), self.block(assigned, depth + 1), orelse)
+
+        name = self.rng.choice(NAMES)
+        stop = ast.Constant(self.rng.randint(0, 4))
+        return ast.For(ast.Name(name, ast.Store()), ast.Call(ast.Name('range', ast.Load()), [stop], []),
+                       self.block(assigned | {name}, depth + 1), [])
+
+    def condition(self, assigned: set[str], depth: int) -> ast.expr:
+        return ast.Compare(self.expression(assigned, depth), [self.rng.choice(COMPARISONS)()],
+                           [self.expression(assigned, depth)])
+
+    def expression(self, assigned: set[str], depth: int) -> ast.expr:
+        kinds = ['constant']
+        if assigned:
+            kinds += ['name', 'name']
+        if depth < self.max_depth:
+            kinds += ['binary', 'binary', 'compare', 'call']
+        kind = self.rng.choice(kinds)
+
+        if kind == 'constant':
+            return ast.Constant(self.rng.randint(-9, 9))
+        if kind == 'name':
+            return ast.Name(self.rng.choice(sorted(assigned)), ast.Load())
+        if kind == 'binary':
+            return ast.BinOp(self.expression(assigned, depth + 1), self.rng.choice(OPERATORS)(),
+                             self.expression(assigned, depth + 1))
+        if kind == 'compare':
+            return self.condition(assigned, depth + 1)
+
+        name = self.rng.choice(sorted(BUILTINS))
+        args = [self.expression(assigned, depth + 1) for _ in range(BUILTINS[name])]
+        return ast.Call(ast.Name(name, ast.Load()), args, [])
+
+
+def generate(seed: int, number: int) -> str:
+    """
+    :return: source of the program, the same for the same seed and number
+    """
+    return ast.unparse(ProgramGenerator(random.Random(f'{seed}:{number}')).program())
+
+
+@dataclass
+class Outcome:
+    output: str
+    error: str | None  # type of the exception, messages aren't compared
+
+
+@dataclass
+class Result:
+    number: int
+    source: str
+    outcomes: dict[str, Outcome] = field(default_factory=dict)
+    seconds: dict[str, float] = field(default_factory=dict)
+    instructions: int | None = None
+
+    def mismatched(self) -> tuple[str, ...]:
+        native = self.outcomes['native']
+        return tuple(backend for backend, outcome in self.outcomes.items() if outcome != native)
+
+    def ratios(self) -> dict[str, float]:
+        native = self.seconds.get('native')
+        return {backend: seconds / native for backend, seconds in self.seconds.items()
+                if backend != 'native' and native}
+
+
+def backends(source: str, options: dict) -> dict:
+    """
+    Zero-argument callables running the program on every back end. Generating the one-liner and decoding
+    aren't part of the run, a back end which fails to prepare the program gets the exception instead
+    """
+    namespace = {'__name__': 'fuzz'}
+    exec(compile(source, '<fuzz>', 'exec'), namespace)
+    func = namespace['main']
+    runs = {'native': func}
+    try:
+        program = virtual_machine.decode(func, options.get('fuse', False))
+        runs['vm'] = lambda: virtual_machine.run(program, virtual_machine.Frame.new(func))
+    except Exception as e:
+        runs['vm'] = e
+    try:
+        oneliner = clean_main.onelinerize(dis.Bytecode(func), walrus=options.get('walrus', False),
+                                          fold=options.get('fold', False), inline=options.get('inline', False))
+        code = compile(oneliner, '<oneliner>', 'exec')
+        runs['oneliner'] = lambda: exec(code, {})
+    except Exception as e:
+        runs['oneliner'] = e
+    return runs
+
+
+def outcome(run) -> Outcome:
+    if isinstance(run, Exception):
+        return Outcome('', type(run).__name__)
+    with isolated_io() as output:
+        try:
+            run()
+        except Exception as e:
+            return Outcome(output.getvalue(), type(e).__name__)
+    return Outcome(output.getvalue(), None)
+
+
+def best_time(run, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        with isolated_io():
+            start = time.perf_counter()
+            try:
+                run()
+            except Exception:
+                pass
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check(number: int, source: str, options: dict, repeat: int) -> Result:
+    result = Result(number, source)
+    runs = backends(source, options)
+    for backend, run in runs.items():
+        result.outcomes[backend] = outcome(run)
+        if not isinstance(run, Exception) and result.outcomes[backend].error is None:
+            result.seconds[backend] = best_time(run, repeat)
+    if result.outcomes['native'].error is None:
+        with isolated_io():
+            try:
+                result.instructions = count_instructions(dis.Bytecode(runs['native']), options.get('fuse', False))
+            except Exception:
+                pass  # the mismatch of the vm is reported anyway
+    return result
+
+
+def variants(tree: ast.Module):
+    """
+    Yields smaller versions of the program: statements removed, if and for replaced with their bodies,
+    expressions replaced with one of their operands and constants with 1
+    """
+    for k, node in enumerate(ast.walk(tree)):
+        for name in ('body', 'orelse'):
+            statements = getattr(node, name, None)
+            if not isinstance(statements, list):
+                continue
+            for i, statement in enumerate(statements):
+                if isinstance(statement, (ast.Return, ast.FunctionDef)):
+                    continue
+                yield edit(tree, k, lambda n, name=name, i=i: getattr(n, name).pop(i))
+                if isinstance(statement, (ast.If, ast.For)):
+                    for part in ('body', 'orelse'):
+                        if getattr(statement, part):
+                            yield edit(tree, k, lambda n, name=name, i=i, part=part:
+                                       getattr(n, name).__setitem__(slice(i, i + 1), getattr(getattr(n, name)[i], part)))
+
+        for name, value in ast.iter_fields(node):
+            if not isinstance(value, ast.expr) or isinstance(value, ast.Name):
+                continue
+            for simpler in simplify(value):
+                yield edit(tree, k, lambda n, name=name, simpler=simpler: setattr(n, name, copy.deepcopy(simpler)))
+
+
+def simplify(expression: ast.expr) -> list[ast.expr]:
+    if isinstance(expression, ast.BinOp):
+        return [expression.left, expression.right]
+    if isinstance(expression, ast.Compare):
+        return [expression.left, *expression.comparators]
+    if isinstance(expression, ast.Call) and expression.func.id in BUILTINS:
+        return expression.args
+    if isinstance(expression, ast.Constant) and expression.value not in (0, 1):
+        return [ast.Constant(1)]
+    return []
+
+
+def edit(tree: ast.Module, k: int, change) -> str | None:
+    """
+    :param k: index of the node to change in ast.walk order, which is the same for the copy
+    :return: source of the changed copy, None if it doesn't compile anymore
+    """
+    tree = copy.deepcopy(tree)
+    change(list(ast.walk(tree))[k])
+    for node in ast.walk(tree):
+        if getattr(node, 'body', None) == []:
+            node.body.append(ast.Pass())
+    source = ast.unparse(ast.fix_missing_locations(tree))
+    try:
+        compile(source, '<fuzz>', 'exec')
+    except SyntaxError:
+        return None
+    return source
+
+
+def minimize(source: str, still_fails, max_checks: int = 500) -> str:
+    """
+    Greedily takes the first smaller variant which still fails until none of them does
+    :param still_fails: called with the source of a variant
+    """
+    checks = 0
+    reduced = True
+    while reduced and checks < max_checks:
+        reduced = False
+        for variant in variants(ast.parse(source)):
+            if variant is None or len(variant) >= len(source):
+                continue
+            checks += 1
+            if still_fails(variant):
+                source = variant
+                reduced = True
+                break
+            if checks >= max_checks:
+                break
+    return source
+
+
+def same_mismatch(variant: Result, result: Result, mismatched: tuple[str, ...]) -> bool:
+    """
+    The same back ends have to differ and native has to end the same way, otherwise removing
+    an assignment turns every mismatch into a NameError
+    """
+    return variant.mismatched() == mismatched and variant.outcomes['native'].error == result.outcomes['native'].error
+
+
+def throughput(results: list[Result]) -> dict[str, float]:
+    """
+    :return: instructions per second of every back end over the programs all back ends ran without errors
+    """
+    timed = [result for result in results if result.instructions and len(result.seconds) == len(BACKENDS)]
+    instructions = sum(result.instructions for result in timed)
+    return {backend: instructions / sum(result.seconds[backend] for result in timed)
+            for backend in BACKENDS if timed}
+
+
+def fuzz(seed: int, numbers, options: dict, repeat: int = 3, outlier: float = 5.0, log=print) -> dict:
+    """
+    :param numbers: numbers of the programs to run
+    :param outlier: a program is an outlier of a back end when its time relative to native is that many times
+        above the median of the run
+    :return: report with the mismatches, outliers and their reproducers and the throughput of every back end
+    """
+    reproduced = [{'source': source, 'backends': mismatched} for source in REPRODUCERS
+                  if (mismatched := check(-1, source, options, 1).mismatched())]
+    for failed in reproduced:
+        log(f'reproducer of a fixed mismatch fails again: {", ".join(failed["backends"])} differ from native')
+    mode = 'walrus' if options.get('walrus') else 'lambda'
+    known = [{'seed': known_seed, 'program': number, 'description': description,
+              'fails': bool(check(number, generate(known_seed, number), options, 1).mismatched())}
+             for known_seed, number, modes, description in KNOWN_MISMATCHES if mode in modes]
+    results = [check(number, generate(seed, number), options, repeat) for number in numbers]
+
+    mismatches = []
+    for result in results:
+        mismatched = result.mismatched()
+        if mismatched:
+            log(f'program {result.number}: {", ".join(mismatched)} differ from native, minimizing')
+            reproducer = minimize(result.source, lambda variant, result=result, mismatched=mismatched:
+                                  same_mismatch(check(result.number, variant, options, 1), result, mismatched))
+            mismatches.append({'program': result.number, 'backends': mismatched, 'reproducer': reproducer,
+                               'outcomes': {backend: vars(outcome)
+                                            for backend, outcome in check(0, reproducer, options, 1).outcomes.items()}})
+
+    medians = {backend: statistics.median(ratios) for backend in BACKENDS[1:]
+               if (ratios := [result.ratios()[backend] for result in results if backend in result.ratios()])}
+    outliers = []
+    for result in results:
+        for backend, ratio in result.ratios().items():
+            limit = medians[backend] * outlier
+            if ratio > limit:
+                log(f'program {result.number}: {backend} is {ratio:.1f}x native, median {medians[backend]:.1f}x, '
+                    f'minimizing')
+                reproducer = minimize(result.source, lambda variant, backend=backend, limit=limit:
+                                      check(result.number, variant, options, repeat).ratios().get(backend, 0) > limit)
+                outliers.append({'program': result.number, 'backend': backend, 'ratio': ratio,
+                                 'median': medians[backend], 'reproducer': reproducer})
+
+    return {'seed': seed, 'programs': len(results), 'options': options, 'reproduced': reproduced,
+            'known': known, 'mismatches': mismatches,
+            'outliers': outliers, 'medians': medians, 'throughput': throughput(results)}
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    :param tolerance: allowed relative drop of throughput against the baseline
+    """
+    found = []
+    if (baseline['seed'], baseline['programs'], baseline['options']) != \
+            (report['seed'], report['programs'], report['options']):
+        return ['baseline was made with another seed, number of programs or options, not comparing']
+    for backend, ips in report['throughput'].items():
+        before = baseline['throughput'].get(backend)
+        if before and ips < before * (1 - tolerance):
+            found.append(f'{backend}: {ips:,.0f} instructions/s, was {before:,.0f} ({ips / before - 1:+.1%})')
+    return found
+
+
+def print_report(report: dict):
+    for failed in report['reproduced']:
+        print(f'\nfixed mismatch is back: {", ".join(failed["backends"])} differ from native')
+        print(failed['source'])
+    for mismatch in report['mismatches']:
+        print(f'\nprogram {mismatch["program"]}: {", ".join(mismatch["backends"])} differ from native')
+        print(mismatch['reproducer'])
+        for backend, outcome in mismatch['outcomes'].items():
+            print(f'  {backend:<10}{outcome["output"]!r} {outcome["error"] or ""}')
+    for found in report['outliers']:
+        print(f'\nprogram {found["program"]}: {found["backend"]} is {found["ratio"]:.1f}x native '
+              f'(median {found["median"]:.1f}x)')
+        print(found['reproducer'])
+
+    for known in report['known']:
+        state = 'still fails' if known['fails'] else 'fixed, move it to REPRODUCERS'
+        print(f'\nknown mismatch, --seed {known["seed"]} --only {known["program"]}: {state}')
+        print(f'  {known["description"]}')
+
+    print(f'\nseed {report["seed"]}, {report["programs"]} programs: {len(report["mismatches"])} mismatches, '
+          f'{len(report["outliers"])} timing outliers')
+    for backend, ips in report['throughput'].items():
+        median = f', median {report["medians"][backend]:.1f}x native' if backend in report['medians'] else ''
+        print(f'{backend:<10}{ips:>16,.0f} instructions/s{median}')
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Differential fuzzing of native, VM and onelinerized execution')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--programs', type=int, default=200, help='number of programs to generate')
+    parser.add_argument('--only', type=int, help='run only the program with this number, it is printed first')
+    parser.add_argument('--walrus', action='store_true', help='one-liners bind variables with assignment expressions')
+    parser.add_argument('--fold', action='store_true', help='one-liners with constant folding')
+    parser.add_argument('--inline', action='store_true', help='one-liners without dead stores and temporaries')
+    parser.add_argument('--fuse', action='store_true', help='VM with superinstructions')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per back end, the best one is used')
+    parser.add_argument('--outlier', type=float, default=5.0, help='times the median ratio to native '
+                                                                   'which makes a timing outlier')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--baseline', help='report of an earlier run to compare the throughput with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop against the baseline')
+    args = parser.parse_args(argv)
+
+    options = {name: True for name in ('walrus', 'fold', 'inline', 'fuse') if getattr(args, name)}
+    numbers = [args.only] if args.only is not None else range(args.programs)
+    if args.only is not None:
+        print(generate(args.seed, args.only))
+
+    report = fuzz(args.seed, numbers, options, args.repeat, args.outlier)
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+    failed = bool(report['mismatches'] or report['reproduced'])
+    if args.baseline:
+        for found in regressions(report, json.loads(Path(args.baseline).read_text()), args.tolerance):
+            print(f'regression: {found}')
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Runtime of one-liners generated with the lambda chain binding against the flat walrus binding.
+Synthetic functions are chains of assignments, the lambda chain is expected to fail on the
+bigger ones because of the parser nesting limit
+
+Run from the repository root: python -m benchmarks.onelinerizer_binding
+"""
+import contextlib
+import dis
+import io
+import timeit
+
+import clean_main
+
+SIZES = (10, 50, 90, 1000, 10000)
+
+
+def synthetic_function(assignments: int):
+    # names are reused so the bytecode doesn't need EXTENDED_ARG
+    lines = ['def main():', '    x0 = 0']
+    for i in range(1, assignments):
+        lines.append(f'    x{i % 50} = x{(i - 1) % 50} + 1')
+    lines.append(f'    print(x{(assignments - 1) % 50})')
+    lines.append('    return')
+
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['main']
+
+
+def generate(func, walrus: bool) -> str:
+    return clean_main.onelinerize(dis.Bytecode(func), walrus=walrus)
+
+
+def measure(source: str, number: int) -> str:
+    try:
+        code = compile(source, '<oneliner>', 'exec')
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = min(timeit.repeat(lambda: exec(code, {}), number=number, repeat=3))
+    except (SyntaxError, RecursionError, MemoryError) as e:
+        return type(e).__name__
+    return f'{elapsed / number * 1e6:.1f}'
+
+
+def main(number: int = 200):
+    print(f'{"assignments":>12}{"lambda chain, us":>20}{"walrus, us":>14}')
+    for size in SIZES:
+        func = synthetic_function(size)
+        lambdas = measure(generate(func, walrus=False), number)
+        walrus = measure(generate(func, walrus=True), number)
+        print(f'{size:>12}{lambdas:>20}{walrus:>14}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Runtime of branches in a loop lowered to conditional expressions against the old
+{True: (lambda: [...])}.get(cond, lambda: None)() lowering, on a simple_game-like loop
+
+Run from the repository root: python -m benchmarks.onelinerizer_branches
+"""
+import dis
+import timeit
+
+import clean_main
+
+ITERATIONS = 100000
+
+
+def main_native():
+    for i in range(ITERATIONS):
+        if i % 3 == 0:
+            abs(i)
+        elif i % 3 == 1:
+            abs(i + 1)
+        else:
+            abs(0)
+    return
+
+
+# what the dict-of-lambdas lowering emits for the same loop, `False:` is the else arm
+DICT_OF_LAMBDAS = (
+    '(lambda: [[[{True: (lambda: [abs(i), ][-1]), False: (lambda: [{True: (lambda: [abs(i + 1), ][-1]), '
+    'False: (lambda: [abs(0), ][-1])}.get(i % 3 == 1, lambda: None)(), ][-1])}.get(i % 3 == 0, lambda: None)(), '
+    f'][-1] for i in iter(range({ITERATIONS}))][-1], None, ][-1])()'
+)
+
+
+def generate(func) -> str:
+    return clean_main.onelinerize(dis.Bytecode(func))
+
+
+def main(repeat: int = 5):
+    namespace = {'ITERATIONS': ITERATIONS}
+    ternary = compile(generate(main_native), '<ternary>', 'exec')
+    dict_of_lambdas = compile(DICT_OF_LAMBDAS, '<dict of lambdas>', 'exec')
+
+    results = {
+        'native': min(timeit.repeat(main_native, number=1, repeat=repeat)),
+        'dict of lambdas': min(timeit.repeat(lambda: exec(dict_of_lambdas, {}), number=1, repeat=repeat)),
+        'ternary': min(timeit.repeat(lambda: exec(ternary, namespace), number=1, repeat=repeat)),
+    }
+
+    print(f'{"lowering":<18}{"time, s":>10}{"vs native":>12}')
+    for name, elapsed in results.items():
+        print(f'{name:<18}{elapsed:>10.4f}{elapsed / results["native"]:>11.2f}x')
+    print(f'ternary speedup over dict of lambdas: {results["dict of lambdas"] / results["ternary"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Peak memory of loops lowered to any(not [...] for ...) against the old [[...][-1] for ...][-1]
+lowering, measured with tracemalloc. The old lowering keeps every iteration's list alive,
+so it is only run on the smaller sizes
+
+Run from the repository root: python -m benchmarks.onelinerizer_memory
+"""
+import dis
+import tracemalloc
+
+import clean_main
+
+SIZES = (10 ** 5, 10 ** 6, 10 ** 7)
+LIST_MAX_SIZE = 10 ** 6
+ITERATIONS = SIZES[0]  # the one-liners get it from the exec namespace
+
+
+def main_native():
+    for i in range(ITERATIONS):
+        abs(i)
+    return
+
+
+# what the list comprehension lowering emits for the same loop
+LIST_COMPREHENSION = '(lambda: [[[abs(i), ][-1] for i in iter(range(ITERATIONS))][-1], None, ][-1])()'
+
+
+def generate(func) -> str:
+    return clean_main.onelinerize(dis.Bytecode(func))
+
+
+def peak_memory(code, iterations: int) -> int:
+    tracemalloc.start()
+    try:
+        exec(code, {'ITERATIONS': iterations})
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    streaming = compile(generate(main_native), '<streaming>', 'exec')
+    list_comprehension = compile(LIST_COMPREHENSION, '<list comprehension>', 'exec')
+
+    print(f'{"iterations":>12}{"list comprehension, KiB":>26}{"streaming, KiB":>18}')
+    for size in SIZES:
+        listed = f'{peak_memory(list_comprehension, size) / 1024:.1f}' if size <= LIST_MAX_SIZE else 'skipped'
+        print(f'{size:>12}{listed:>26}{peak_memory(streaming, size) / 1024:>18.1f}')
+
+
+if __name__ == '__main__':
+    main()
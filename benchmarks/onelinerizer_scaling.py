@@ -0,0 +1,78 @@
+"""
+Checks that onelinerizer output generation grows linearly with the size of the function.
+Synthetic functions mix assignments, for loops and ifs, the slope of log(time) over log(size)
+should stay close to 1, the script exits with 1 if it doesn't
+
+Run from the repository root: python -m benchmarks.onelinerizer_scaling
+"""
+import dis
+import math
+import sys
+import time
+
+import clean_main
+import main as legacy_main
+from ir import get_ir
+
+SIZES = (500, 1000, 2000, 4000, 8000)
+MAX_SLOPE = 1.3
+
+
+def synthetic_source(statements: int) -> str:
+    # names and constants are reused so the bytecode doesn't need EXTENDED_ARG
+    lines = ['def main():', '    x0 = 0']
+    for i in range(1, statements):
+        name, prev = f'x{i % 50}', f'x{(i - 1) % 50}'
+        match i % 3:
+            case 0:
+                lines.append(f'    {name} = {prev} + {i % 100}')
+            case 1:
+                lines.append(f'    for {name} in range({i % 10}):')
+                lines.append(f'        print({name})')
+            case 2:
+                lines.append(f'    if {prev} > {i % 100}:')
+                lines.append(f'        print({prev})')
+    lines.append('    return')
+    return '\n'.join(lines)
+
+
+def synthetic_function(statements: int):
+    namespace = {}
+    exec(synthetic_source(statements), namespace)
+    return namespace['main']
+
+
+def measure(generate, func, repeat: int) -> float:
+    # dis.findlabels itself is quadratic in the number of jumps, so the shared IR is decoded
+    # before the timer starts and only output generation is measured
+    get_ir(func)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generate(dis.Bytecode(func))
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(repeat: int = 3) -> float:
+    backends = {'clean_main.onelinerize': clean_main.onelinerize, 'main.onelinerize': legacy_main.onelinerize}
+    funcs = {size: synthetic_function(size) for size in SIZES}
+    worst = 0.0
+
+    print(f'{"backend":<20}{"statements":>12}{"time, s":>12}{"us/statement":>14}')
+    for name, generate in backends.items():
+        times = {size: measure(generate, func, repeat) for size, func in funcs.items()}
+        for size, elapsed in times.items():
+            print(f'{name:<20}{size:>12}{elapsed:>12.4f}{elapsed / size * 1e6:>14.2f}')
+
+        slope = math.log(times[SIZES[-1]] / times[SIZES[0]]) / math.log(SIZES[-1] / SIZES[0])
+        print(f'{name:<20}{"slope":>12}{slope:>12.2f}')
+        worst = max(worst, slope)
+
+    return worst
+
+
+if __name__ == '__main__':
+    if main() > MAX_SLOPE:
+        print(f'generation time grows faster than linearly (slope > {MAX_SLOPE})')
+        sys.exit(1)
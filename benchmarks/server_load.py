@@ -0,0 +1,78 @@
+"""
+Throughput and latency of the emulation server with different numbers of workers.
+Every sample is submitted many times at once by concurrent clients, the metrics of the server
+are printed after the burst. One job run by a fresh interpreter is timed for comparison,
+that's what every job would cost without the prewarmed workers
+
+Run from the repository root: python -m benchmarks.server_load [--jobs 200] [--workers 1 2 4]
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.common import STDIN, sample_paths
+from server import EmulationServer
+
+
+async def submit(port: int, job: dict) -> dict:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(json.dumps(job).encode() + b'\n')
+    await writer.drain()
+    while not (message := json.loads(await reader.readline())).get('done'):
+        pass
+    writer.close()
+    return message
+
+
+async def burst(workers: int, jobs: list[dict]) -> tuple[float, dict]:
+    server = EmulationServer(workers)
+    await server.start()
+    try:
+        listening = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        async with listening:
+            start = time.perf_counter()
+            results = await asyncio.gather(*(submit(port, job) for job in jobs))
+            seconds = time.perf_counter() - start
+            failed = [result['error'] for result in results if result['error']]
+            if failed:
+                raise RuntimeError(f'{len(failed)} jobs failed, the first one with {failed[0]}')
+            return seconds, server.metrics.snapshot(server.jobs.qsize(), server.busy, workers)
+    finally:
+        server.stop()
+
+
+def fresh_interpreter(path) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', f'import virtual_machine; from benchmarks.common import load_main; '
+                                          f'from pathlib import Path; '
+                                          f'virtual_machine.emulate(load_main(Path({str(path)!r})))'],
+                   input=STDIN, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Load test of the emulation server')
+    parser.add_argument('--jobs', type=int, default=200, help='number of jobs submitted at once')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args(argv)
+
+    paths = sample_paths()
+    sources = [{'source': path.read_text(), 'stdin': STDIN} for path in paths]
+    jobs = [sources[i % len(sources)] for i in range(args.jobs)]
+
+    print(f'fresh interpreter per job: {min(fresh_interpreter(paths[0]) for _ in range(3)) * 1000:.1f} ms '
+          f'for {paths[0].stem}')
+    print(f'{"workers":>8}{"seconds":>10}{"jobs/s":>10}{"p50, ms":>10}{"p90, ms":>10}{"p99, ms":>10}{"queued p50":>12}')
+    for workers in args.workers:
+        seconds, metrics = asyncio.run(burst(workers, jobs))
+        latency = metrics['latency']
+        print(f'{workers:>8}{seconds:>10.2f}{args.jobs / seconds:>10.1f}{latency["p50"] * 1000:>10.1f}'
+              f'{latency["p90"] * 1000:>10.1f}{latency["p99"] * 1000:>10.1f}{metrics["queued"]["p50"] * 1000:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
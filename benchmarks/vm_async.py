@@ -0,0 +1,67 @@
+"""
+Many interactive emulations of simple_game in one event loop. Every input takes a while to arrive,
+like a user typing, so the sessions mostly wait and the loop has to switch between them.
+Reports the time for all sessions against the time one of them needs, and the worst delay
+of a timer task, which is the longest pass of the loop over the sessions ready at the same time
+
+Run from the repository root: python -m benchmarks.vm_async [--sessions 1000] [--latency 0.01] [--batch 1000]
+"""
+import argparse
+import asyncio
+import time
+
+import virtual_machine
+from benchmarks.common import SAMPLES_DIR, load_main
+
+ANSWERS = ['player'] + ['10'] * 6  # name and six guesses
+
+
+async def session(game, latency: float, batch: int) -> int:
+    answers = iter(ANSWERS)
+    printed = []
+
+    async def input_hook(prompt: str) -> str:
+        await asyncio.sleep(latency)
+        return next(answers)
+
+    async def print_hook(text: str):
+        printed.append(text)
+
+    return await virtual_machine.emulate_async(game, input_hook, print_hook, batch=batch)
+
+
+async def worst_lag(done: asyncio.Event, interval: float = 0.001) -> float:
+    worst = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def measure(game, sessions: int, latency: float, batch: int) -> tuple[float, float, int]:
+    done = asyncio.Event()
+    lag = asyncio.create_task(worst_lag(done))
+    start = time.perf_counter()
+    executed = await asyncio.gather(*(session(game, latency, batch) for _ in range(sessions)))
+    seconds = time.perf_counter() - start
+    done.set()
+    return seconds, await lag, sum(executed)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Concurrent asynchronous emulations of simple_game')
+    parser.add_argument('--sessions', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds before every input arrives')
+    parser.add_argument('--batch', type=int, default=1000, help='instructions between yields to the event loop')
+    args = parser.parse_args(argv)
+
+    game = load_main(SAMPLES_DIR / 'simple_game.py')
+    for sessions in (1, args.sessions):
+        seconds, lag, executed = asyncio.run(measure(game, sessions, args.latency, args.batch))
+        print(f'{sessions:>6} sessions: {seconds:8.3f}s, {sessions / seconds:>10,.0f} sessions/s, '
+              f'{executed / seconds:>12,.0f} instructions/s, worst loop lag {lag * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Cost of checkpoints: time and size of one checkpoint and the share of the emulation time
+spent making them when a checkpoint is made every N instructions. fib and hanoi spend almost all the time in calls
+of emulated functions, checkpoints are only made between instructions of main itself, so they get none.
+Before timing, every sample is resumed from a checkpoint made in the middle of it and has to print the rest
+of its output, fib keeps a recursive closure on the stack, so that one checks that cycles survive pickling
+
+Run from the repository root: python -m benchmarks.vm_checkpoint [--every 1000 10000 100000]
+"""
+import argparse
+import dis
+import random
+import sys
+import time
+
+import checkpoint
+from benchmarks.common import isolated_io, load_main, sample_paths
+
+
+def measure(run, repeat: int):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        with isolated_io():
+            start = time.perf_counter()
+            result = run()
+            best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def check_resume(bytecode: dis.Bytecode, every: int = 10):
+    """
+    Resumes from the middle checkpoint with the same stdin position and random state,
+    the output printed before it and after the resume must add up to the output of a whole run
+    """
+    saved = []
+    with isolated_io() as output:
+        checkpoint.emulate(bytecode, every, lambda data, executed: saved.append(
+            (data, len(output.getvalue()), sys.stdin.tell(), random.getstate())))
+        expected = output.getvalue()
+    if not saved:
+        return
+    data, printed, position, state = saved[len(saved) // 2]
+    with isolated_io() as output:
+        sys.stdin.seek(position)
+        random.setstate(state)
+        checkpoint.resume(data)
+    if expected[:printed] + output.getvalue() != expected:
+        raise AssertionError(f'resuming {bytecode.codeobj.co_filename} from a checkpoint changed its output')
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Cost of automatic checkpoints of the VM')
+    parser.add_argument('--every', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f'{"sample":<14}{"every":>8}{"checkpoints":>13}{"us each":>10}{"bytes":>8}{"share":>8}')
+    for path in sample_paths():
+        bytecode = dis.Bytecode(load_main(path))
+        check_resume(bytecode)
+        for every in args.every:
+            seconds, stats = measure(lambda: checkpoint.emulate(bytecode, every, lambda data, executed: None),
+                                     args.repeat)
+            each = f'{stats.seconds / stats.checkpoints * 1e6:.0f}' if stats.checkpoints else '-'
+            print(f'{path.stem:<14}{every:>8}{stats.checkpoints:>13}{each:>10}{stats.max_bytes:>8}'
+                  f'{stats.seconds / seconds:>8.1%}')
+
+
+if __name__ == '__main__':
+    main()
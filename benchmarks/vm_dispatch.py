@@ -0,0 +1,47 @@
+"""
+Instructions per second of the legacy VM loop against the decoded one on the samples.
+The legacy loop doesn't support functions, samples with them are measured only on the decoded one
+
+Run from the repository root: python -m benchmarks.vm_dispatch
+"""
+import dis
+import time
+
+import virtual_machine
+from benchmarks.common import count_instructions, isolated_io, load_main, sample_paths
+
+
+def measure(emulate, bytecode: dis.Bytecode, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        with isolated_io():
+            start = time.perf_counter()
+            emulate(bytecode)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(repeat: int = 5):
+    rows = []
+    for path in sample_paths():
+        bytecode = dis.Bytecode(load_main(path))
+        with isolated_io():
+            executed = count_instructions(bytecode)
+        decoded = measure(virtual_machine.emulate, bytecode, repeat)
+        try:
+            legacy = measure(virtual_machine.emulate_legacy, bytecode, repeat)
+        except NotImplementedError:
+            rows.append((path.stem, executed, None, executed / decoded, None))
+            continue
+        rows.append((path.stem, executed, executed / legacy, executed / decoded, legacy / decoded))
+
+    print(f'{"sample":<14}{"instructions":>14}{"legacy ips":>16}{"decoded ips":>16}{"speedup":>10}')
+    for name, executed, legacy, decoded, speedup in rows:
+        if legacy is None:
+            print(f'{name:<14}{executed:>14}{"-":>16}{decoded:>16,.0f}{"-":>10}')
+            continue
+        print(f'{name:<14}{executed:>14}{legacy:>16,.0f}{decoded:>16,.0f}{speedup:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Dispatches and instructions per second of the decoded VM loop with and without superinstructions.
+Instructions per second are counted in original instructions for both, so the numbers can be compared.
+Programs are decoded before the timer, the fusion pass itself isn't measured
+
+Run from the repository root: python -m benchmarks.vm_fusion
+"""
+import dis
+import time
+
+import virtual_machine
+from benchmarks.common import count_instructions, isolated_io, load_main, sample_paths
+
+
+def measure(bytecode: dis.Bytecode, fuse: bool, repeat: int) -> float:
+    program = virtual_machine.decode(bytecode, fuse)
+    best = float('inf')
+    for _ in range(repeat):
+        frame = virtual_machine.Frame.new(bytecode)
+        frame.fuse = fuse
+        with isolated_io():
+            start = time.perf_counter()
+            virtual_machine.run(program, frame)
+            best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(repeat: int = 5):
+    rows = []
+    for path in sample_paths():
+        bytecode = dis.Bytecode(load_main(path))
+        with isolated_io():
+            executed = count_instructions(bytecode)
+            dispatched = count_instructions(bytecode, fuse=True)
+        plain = measure(bytecode, False, repeat)
+        fused = measure(bytecode, True, repeat)
+        rows.append((path.stem, executed, dispatched, executed / plain, executed / fused, plain / fused))
+
+    print(f'{"sample":<14}{"instructions":>14}{"dispatches":>12}{"saved":>8}'
+          f'{"plain ips":>16}{"fused ips":>16}{"speedup":>10}')
+    for name, executed, dispatched, plain, fused, speedup in rows:
+        print(f'{name:<14}{executed:>14}{dispatched:>12}{1 - dispatched / executed:>8.1%}'
+              f'{plain:>16,.0f}{fused:>16,.0f}{speedup:>9.2f}x')
+
+
+if __name__ == '__main__':
+    main()
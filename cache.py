@@ -0,0 +1,145 @@
+"""
+Persistent cache for onelinerizer and decompiler results.
+Results are keyed by the content of the code object, the bytecode magic number and the source of the modules
+which generate them, so unchanged functions are served from disk without decoding and a changed onelinerizer
+doesn't get the results of the old one. Entries live in an sqlite database, which makes
+it safe to share the cache between several processes
+"""
+import dis
+import functools
+import hashlib
+import importlib.util
+import sqlite3
+import time
+from pathlib import Path
+
+FORMAT = 1  # version of the keys and stored results, bump it when either changes
+
+
+class ResultCache:
+    def __init__(self, path: Path | str, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param path: sqlite database file, created if it doesn't exist
+        :param max_bytes: least recently used results are evicted once all results take more than that
+        """
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # autocommit, every statement is its own transaction and waits for other processes instead of failing
+        self.db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS results '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+    @staticmethod
+    def key(code, namespace: str, options: dict = None) -> str:
+        """
+        :param code: code object
+        :param namespace: what produced the result, so different tools don't share entries
+        :param options: keyword arguments which change the result
+        """
+        digest = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        digest.update(f'{FORMAT}:{generator_digest()}:{namespace}:{sorted((options or {}).items())}'.encode())
+        digest.update(repr(content(code)).encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> str | None:
+        row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, value: str):
+        self.db.execute(
+            'INSERT OR REPLACE INTO results (key, value, size, used) VALUES (?, ?, ?, ?)',
+            (key, value, len(value.encode()), time.time())
+        )
+        self.evict()
+
+    def evict(self):
+        # everything after the most recently used max_bytes goes away
+        self.db.execute(
+            'DELETE FROM results WHERE key IN ('
+            '  SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY used DESC) AS total FROM results)'
+            '  WHERE total > ?'
+            ')',
+            (self.max_bytes,)
+        )
+
+    def stats(self) -> dict:
+        entries, size = self.db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        self.db.close()
+
+
+@functools.cache
+def generator_digest() -> str:
+    """
+    Hash of the modules of the package, any change of the onelinerizer or the decompiler changes every key.
+    Computed once per process
+    """
+    digest = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        digest.update(path.name.encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def content(value):
+    """
+    Representation of a code object which only depends on what's in it. marshal can't be used,
+    it marks objects referenced more than once, so its output changes with reference counts
+    and the same code object could get another key later in the same process.
+    Signatures are part of it, def f(a) and def f(*a) have the same instructions
+    """
+    if hasattr(value, 'co_code'):
+        return (value.co_code, value.co_names, value.co_varnames, value.co_cellvars, value.co_freevars,
+                value.co_argcount, value.co_posonlyargcount, value.co_kwonlyargcount, value.co_flags,
+                tuple(map(content, value.co_consts)))
+    if isinstance(value, tuple):
+        return tuple(map(content, value))
+    if isinstance(value, frozenset):  # the order depends on the hash seed
+        return sorted(map(repr, map(content, value)))
+    return value
+
+
+def cached(generate, cache: ResultCache):
+    """
+    Wraps clean_main.onelinerize or decompiler.decompile, when the code object was already processed
+    the result is taken from the cache and the bytecode isn't decoded at all
+    """
+    namespace = f'{generate.__module__}.{generate.__qualname__}'
+
+    @functools.wraps(generate)
+    def wrapper(bytecode: dis.Bytecode, **kwargs) -> str:
+        key = cache.key(bytecode.codeobj, namespace, kwargs)
+        result = cache.get(key)
+        if result is None:
+            result = generate(bytecode, **kwargs)
+            cache.put(key, result)
+        return result
+
+    return wrapper
+
+
+if __name__ == '__main__':
+    import clean_main
+    from samples.simple_game import main as sample
+
+    cache = ResultCache('.cache/results.sqlite')
+    onelinerize = cached(clean_main.onelinerize, cache)
+    print(onelinerize(dis.Bytecode(sample)))
+    print(onelinerize(dis.Bytecode(sample)))
+    print(cache.stats())
@@ -0,0 +1,270 @@
+"""
+Checkpoints of running emulations. A checkpoint keeps the state of the frame of the emulated code:
+the instruction index, the value stack, fast locals and names, so the emulation can be continued from it
+later, in the same process or in another one running the same Python version.
+Iterators are saved with their position when they can be pickled, like iterators of ranges, lists,
+strings and tuples, enumerate and zip over them. Generators can't be, a checkpoint with one on the stack fails.
+Modules are saved by name and imported again, their state (for example of random) isn't kept.
+Checkpoints are made only between instructions of the code itself, never inside calls of emulated functions
+
+Usage:
+    python checkpoint.py PROGRAM.py [--function main] [--every N] [--save PATH]
+    python checkpoint.py --resume PATH [--every N] [--save PATH]
+
+The latest checkpoint is written to --save, statistics of checkpointing go to stderr
+"""
+import argparse
+import dis
+import importlib
+import importlib.util
+import io
+import itertools
+import marshal
+import os
+import pickle
+import sys
+import time
+import zlib
+from dataclasses import dataclass
+from types import CellType, CodeType, ModuleType
+
+import virtual_machine
+from ir import get_ir
+from virtual_machine import Frame, Function, Namespace
+
+BATCH = 4096  # the most instructions between checks whether a checkpoint is due
+
+
+def load_code(data: bytes) -> CodeType:
+    return marshal.loads(data)
+
+
+def make_cell() -> CellType:
+    return CellType()
+
+
+def fill_cell(cell: CellType, contents: tuple):
+    if contents:
+        cell.cell_contents = contents[0]
+
+
+def new_function(code: CodeType) -> Function:
+    """
+    Unpickler replaces it with Unpickler.new_function, this one is only for pickle to find by name
+    """
+    return Function(code, Namespace.of(None))
+
+
+def fill_function(function: Function, state: tuple):
+    function.defaults, function.closure = state
+
+
+class Pickler(pickle.Pickler):
+    """
+    Pickles code objects with marshal, cells with their contents and modules by name.
+    Emulated functions are saved without their globals and runner, Unpickler gives them the ones of the frame.
+    Contents of cells and closures of functions are saved as the state, which is pickled after the object
+    itself is memoized, so a function holding itself in its closure doesn't recurse forever
+    """
+
+    def __init__(self, file):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+
+    def reducer_override(self, obj):
+        if type(obj) is CodeType:
+            return load_code, (marshal.dumps(obj),)
+        if type(obj) is CellType:
+            try:
+                contents = (obj.cell_contents,)
+            except ValueError:
+                contents = ()
+            return make_cell, (), contents, None, None, fill_cell
+        if type(obj) is Function:
+            return new_function, (obj.code,), (obj.defaults, obj.closure), None, None, fill_function
+        if isinstance(obj, ModuleType):
+            return importlib.import_module, (obj.__name__,)
+        return NotImplemented
+
+
+class Unpickler(pickle.Unpickler):
+    def __init__(self, file, frame: Frame):
+        """
+        :param frame: frame the emulated functions are made in
+        """
+        super().__init__(file)
+        self.frame = frame
+
+    def find_class(self, module: str, name: str):
+        if (module, name) == (__name__, 'new_function'):
+            return self.new_function
+        return super().find_class(module, name)
+
+    def new_function(self, code: CodeType) -> Function:
+        return self.frame.make_function(code, (), ())
+
+
+@dataclass
+class State:
+    code: CodeType
+    fuse: bool
+    executed: int
+    index: int
+    stack: list
+    locals: list
+    names: dict
+
+
+def dumps(frame: Frame, code: CodeType, executed: int = 0) -> bytes:
+    """
+    :param frame: frame of the code, between two instructions
+    :param executed: number of instructions executed so far, kept in the checkpoint
+    :return: compressed checkpoint
+    """
+    buffer = io.BytesIO()
+    buffer.write(importlib.util.MAGIC_NUMBER)  # indexes are only valid for the same bytecode
+    Pickler(buffer).dump(State(code, frame.fuse, executed, frame.index, frame.stack, frame.locals, frame.names))
+    return zlib.compress(buffer.getvalue(), 1)
+
+
+def loads(data: bytes, globals: dict = None) -> tuple[Frame, CodeType, int]:
+    """
+    :param globals: globals of the emulated code, read live like the module globals on emulate, only builtins by default
+    :return: frame ready to continue, its code and the number of instructions executed before the checkpoint
+    """
+    buffer = io.BytesIO(zlib.decompress(data))
+    if buffer.read(len(importlib.util.MAGIC_NUMBER)) != importlib.util.MAGIC_NUMBER:
+        raise ValueError('The checkpoint was made by another Python version')
+
+    frame = Frame(globals=Namespace(globals))
+    state = Unpickler(buffer, frame).load()
+    frame.varnames = virtual_machine.local_names(state.code)
+    frame.fuse = state.fuse
+    frame.index = state.index
+    frame.stack = state.stack
+    frame.locals = state.locals
+    frame.names = state.names
+    return frame, state.code, state.executed
+
+
+@dataclass
+class Stats:
+    checkpoints: int = 0
+    failed: int = 0  # checkpoints which couldn't be made, a generator was on the stack for example
+    seconds: float = 0.0  # total time spent making checkpoints
+    bytes: int = 0  # size of the last checkpoint
+    max_bytes: int = 0
+    error: str | None = None  # why the last failed checkpoint failed
+
+    def __str__(self):
+        if not self.checkpoints:
+            return f'no checkpoints, {self.failed} failed'
+        return (f'{self.checkpoints} checkpoints, {self.failed} failed, '
+                f'{self.seconds / self.checkpoints * 1e6:.0f} us each, {self.seconds:.4f}s in total, '
+                f'last {self.bytes} bytes, largest {self.max_bytes} bytes')
+
+
+def run(frame: Frame, code: CodeType, executed: int = 0, every: int = None, on_checkpoint=None,
+        max_instructions: int = None, timeout: float = None) -> Stats:
+    """
+    Emulates the code from the state of the frame and makes a checkpoint every few instructions
+    :param every: instructions between checkpoints, rounded up to batches of up to 4096 instructions
+    :param on_checkpoint: called as on_checkpoint(data, executed) with every checkpoint
+    :param max_instructions: same as for emulate, instructions executed before the frame count too
+    :param timeout: same as for emulate
+    """
+    program, instructions, _ = virtual_machine.compile_code(code, frame.fuse)
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    stats = Stats()
+    last = executed
+
+    budget = virtual_machine.Budget(max_instructions - executed if max_instructions is not None else None)
+
+    def runner(function: Function, function_frame: Frame):
+        if max_instructions is None and deadline is None:
+            virtual_machine.run(function.program, function_frame)
+        else:
+            virtual_machine.run_limited(function.program, function_frame, function.instructions, budget, deadline)
+
+    def on_batch(frame: Frame, done: int):
+        nonlocal last
+        if done + executed - last < every:
+            return
+        last = done + executed
+        start = time.perf_counter()
+        try:
+            data = dumps(frame, code, last)
+        except (TypeError, AttributeError, RecursionError, pickle.PicklingError) as e:  # unpicklable objects
+            stats.failed += 1
+            stats.error = f'{type(e).__name__}: {e}'
+            return
+        stats.seconds += time.perf_counter() - start
+        stats.checkpoints += 1
+        stats.bytes = len(data)
+        stats.max_bytes = max(stats.max_bytes, len(data))
+        if on_checkpoint is not None:
+            on_checkpoint(data, last)
+
+    frame.runner = runner
+    if every is None:
+        if max_instructions is None and deadline is None:
+            virtual_machine.run(program, frame)
+        else:
+            virtual_machine.run_limited(program, frame, instructions, budget, deadline)
+        return stats
+    virtual_machine.run_limited(program, frame, instructions, budget, deadline, min(every, BATCH), on_batch)
+    return stats
+
+
+def emulate(bytecode: dis.Bytecode, every: int = None, on_checkpoint=None, max_instructions: int = None,
+            timeout: float = None, fuse: bool = False) -> Stats:
+    """
+    Same as virtual_machine.emulate with checkpoints, see run
+    """
+    frame = Frame.new(bytecode)
+    frame.fuse = fuse
+    return run(frame, get_ir(bytecode).code, 0, every, on_checkpoint, max_instructions, timeout)
+
+
+def resume(data: bytes, every: int = None, on_checkpoint=None, max_instructions: int = None,
+           timeout: float = None, globals: dict = None) -> Stats:
+    """
+    Continues the emulation from the checkpoint, see run and loads
+    """
+    frame, code, executed = loads(data, globals)
+    return run(frame, code, executed, every, on_checkpoint, max_instructions, timeout)
+
+
+def main(argv: list[str] = None):
+    from batch import find_functions
+
+    parser = argparse.ArgumentParser(description='Emulate a function with checkpoints or resume from one')
+    parser.add_argument('program', nargs='?', help='file with the function to emulate')
+    parser.add_argument('--function', default='main', help='name of the function to emulate')
+    parser.add_argument('--resume', help='checkpoint to continue from instead of a program')
+    parser.add_argument('--every', type=int, default=100_000, help='instructions between checkpoints')
+    parser.add_argument('--save', help='file to keep the latest checkpoint in')
+    args = parser.parse_args(argv)
+    if (args.program is None) == (args.resume is None):
+        parser.error('either a program or --resume is needed')
+
+    def save(data: bytes, executed: int):
+        if args.save:  # replaced at once, so an interrupted write doesn't lose the previous checkpoint
+            with open(args.save + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(args.save + '.tmp', args.save)
+
+    if args.resume:
+        with open(args.resume, 'rb') as file:
+            stats = resume(file.read(), args.every, save)
+    else:
+        with open(args.program) as file:
+            code = compile(file.read(), args.program, 'exec')
+        function = next(itertools.chain(find_functions(code, args.function), [None]))
+        if function is None:
+            parser.error(f'{args.function} is not defined in {args.program}')
+        stats = emulate(function, args.every, save)
+    print(stats, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
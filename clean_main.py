@@ -2,46 +2,106 @@
 Obfuscates the code and makes it a one-liner
 """
 import dis
-from opcodes import opcodes_map
+import math
+import sys
+from typing import Iterator, TextIO
+from folding import get_folded_ir
+from ir import get_ir
+from liveness import get_pruned_ir
+from opcodes import Indent, opcodes_map
 
 
-def emulate(bytecode: dis.Bytecode):
+def generate(bytecode: dis.Bytecode, walrus: bool = False, fold: bool = False, inline: bool = False) -> Iterator[str]:
+    """
+    Yields fragments of the one-liner as soon as they are known, the output is produced strictly
+    from left to right, so nothing has to be kept after it's yielded
+    :param bytecode: bytecode from dis, function or code object
+    :param walrus: bind variables with assignment expressions inside one flat list instead of
+        wrapping the rest of the function in a lambda for every assignment, so the nesting depth
+        doesn't grow with the number of assignments
+    :param fold: evaluate constant expressions and drop branches with a known condition, see folding
+    :param inline: drop stores which are never read and inline variables read only once, see liveness
+    """
     stack = []
-    indents = []
+    temps = {}  # expressions of inlined variables waiting for their LOAD_TEMP
+    # the function itself is the outermost block, it's never closed by an offset
+    indents = [Indent(math.inf, '][-1])()')]
 
-    start = '(lambda: ['
-    end = '][-1])()'
+    # endings are collected in the block they belong to and written out when the block is closed
+    last = '(lambda: ['
+    yield last
+
+    def write(fragment: str) -> Iterator[str]:
+        # a fragment closing a list right after it was opened (an empty block, or an if arm
+        # before its else) would make [][-1], which fails
+        if fragment.startswith(']') and last.endswith('['):
+            yield 'None, '
+        yield fragment
+
+    def close(indent: Indent, offset: float) -> Iterator[str]:
+        yield from write(indent.close())
+        if indent.guard is not None and indents and indents[-1].line_to > offset:
+            # a continue inside the block skips the rest of the loop body after it too
+            indents.append(Indent(indents[-1].line_to, f'][-1] if not {indent.guard} else None), '))
+            yield '(['
 
     instr_i = 0
-    instructions = list(bytecode)
-
-    # for instr in bytecode:
-    #     instructions.append(instr)
-    #     if instr.opname == 'JUMP_FORWARD':
-    #         # else branch is not implemented in the bytecode, so in order to decompile it with proper indents
-    #         # I created this instruction
-    #         instructions.append(
-    #             dis.Instruction(opname='SUP_ELSE', opcode=-111, arg=instr.arg, argval=instr.argval,
-    #                             argrepr=instr.argrepr, offset=instr.offset + 2,
-    #                             starts_line=0, is_jump_target=False)
-    #         )
+    if inline:
+        ir = get_pruned_ir(bytecode, fold)
+    else:
+        ir = get_folded_ir(bytecode) if fold else get_ir(bytecode)
+    instructions = ir.instructions
 
     while instr_i < len(instructions):
         instr = instructions[instr_i]
         instr_i += 1
 
+        while instr.offset >= indents[-1].line_to:
+            for last in close(indents.pop(), instr.offset):
+                yield last
+
         if instr.opname not in opcodes_map:
             raise ValueError(f'Unknown opname: {instr.opname}')
 
-        instruction = opcodes_map[instr.opname](instr, stack, {}, instr_i, indents.copy(), instructions)
-        res = instruction.execute_onelinerizer()
-        start += res[0]
-        end = res[1] + end
+        instruction = opcodes_map[instr.opname](instr, stack, temps, instr_i, indents, instructions)
+        res = instruction.execute_onelinerizer_walrus() if walrus else instruction.execute_onelinerizer()
+        if res[0]:
+            for last in write(res[0]):
+                yield last
+        if res[1]:
+            indents[-1].ends.append(res[1])
         stack = instruction.stack
         instr_i = instruction.index
         indents = instruction.indents
 
-    print(start + end)
+    while indents:
+        for last in close(indents.pop(), math.inf):
+            yield last
+
+
+def onelinerize(bytecode: dis.Bytecode, **options) -> str:
+    """
+    :param options: keyword arguments of generate
+    :return: the one-liner
+    """
+    return ''.join(generate(bytecode, **options))
+
+
+def write(bytecode: dis.Bytecode, file: TextIO, **options):
+    """
+    Writes the one-liner to the file-like object piece by piece without building it in memory
+    :param options: keyword arguments of generate
+    """
+    for fragment in generate(bytecode, **options):
+        file.write(fragment)
+
+
+def emulate(bytecode: dis.Bytecode, walrus: bool = False, fold: bool = False, inline: bool = False):
+    """
+    Prints the one-liner, see generate for the parameters
+    """
+    write(bytecode, sys.stdout, walrus=walrus, fold=fold, inline=inline)
+    print()
 
 
 if __name__ == '__main__':
@@ -3,26 +3,35 @@ Decompiler from Python bytecode
 """
 
 import dis
+import heapq
+import sys
+from typing import Iterator, TextIO
+from folding import get_folded_ir
+from ir import get_ir
 from opcodes import opcodes_map
 
 
-def emulate(bytecode: dis.Bytecode):
+def generate(bytecode: dis.Bytecode, fold: bool = False) -> Iterator[str]:
+    """
+    Yields decompiled lines, each ends with a newline
+    :param bytecode: bytecode from dis, function or code object
+    :param fold: evaluate constant expressions and drop branches with a known condition, see folding
+    """
     stack = []
-    indents = []
+    indents = []  # min-heap of offsets where the blocks end, the closest one is indents[0]
 
-    def ind_print(*args, **kwargs):
-        print('\t' * len(indents), end='')
-        print(*args, **kwargs)
+    ir = get_folded_ir(bytecode) if fold else get_ir(bytecode)
+    else_ends = {region.header: region.end for region in ir.regions if region.kind == 'else'}
 
     instr_i = 0
     instructions = []
-    for instr in bytecode:
+    for i, instr in enumerate(ir.instructions):
         instructions.append(instr)
-        if instr.opname == 'JUMP_FORWARD':
+        if i in else_ends:
             # else branch is not implemented in the bytecode, so in order to decompile it with proper indents
             # I created this instruction
             instructions.append(
-                dis.Instruction(opname='SUP_ELSE', opcode=-111, arg=instr.arg, argval=instr.argval,
+                dis.Instruction(opname='SUP_ELSE', opcode=-111, arg=instr.arg, argval=else_ends[i],
                                 argrepr=instr.argrepr, offset=instr.offset + 2,
                                 starts_line=0, is_jump_target=False)
             )
@@ -31,22 +40,44 @@ def emulate(bytecode: dis.Bytecode):
         instr = instructions[instr_i]
         instr_i += 1
 
-        indents.sort(reverse=True)  # not cool for large number of elems, but I'm sure noone has more than 6-7 indents
-        while len(indents) != 0 and instr.offset >= indents[-1]:
-            indents.pop()
+        while len(indents) != 0 and instr.offset >= indents[0]:
+            heapq.heappop(indents)
 
         if instr.opname not in opcodes_map:
             raise ValueError(f'Unknown opname: {instr.opname}')
 
-        instruction = opcodes_map[instr.opname](instr, stack, {}, instr_i, indents.copy(), instructions)
+        # the instruction may open a block, but its own line belongs to the current one
+        depth = len(indents)
+        instruction = opcodes_map[instr.opname](instr, stack, {}, instr_i, indents, instructions)
         res = instruction.execute_decompiler()
         if res != '':
-            ind_print(res)
+            yield '\t' * depth + res + '\n'
         stack = instruction.stack
         instr_i = instruction.index
         indents = instruction.indents
 
 
+def decompile(bytecode: dis.Bytecode, fold: bool = False) -> str:
+    """
+    :return: decompiled source, see generate for the parameters
+    """
+    return ''.join(generate(bytecode, fold))
+
+
+def write(bytecode: dis.Bytecode, file: TextIO, fold: bool = False):
+    """
+    Writes the decompiled source to the file-like object line by line, see generate for the parameters
+    """
+    file.writelines(generate(bytecode, fold))
+
+
+def emulate(bytecode: dis.Bytecode, fold: bool = False):
+    """
+    Prints the decompiled source, see generate for the parameters
+    """
+    write(bytecode, sys.stdout, fold)
+
+
 if __name__ == '__main__':
     from samples.sum import main as sample
     dis.dis(sample)
@@ -0,0 +1,219 @@
+"""
+Folding pass shared by the decompiler and the onelinerizer. It rewrites the instructions of a code object:
+variables assigned a constant once at the very start are replaced with the constant, operations on
+constants are evaluated, branches with a known condition are resolved and the code which became
+unreachable is dropped. Offsets of the remaining instructions don't change
+"""
+import dis
+import functools
+import math
+import re
+from types import CodeType
+
+from ir import IR, JUMPS, TERMINATORS, UNCONDITIONAL_JUMPS, build, get_ir
+from opcodes import BINARY_OPS, COMPARE_OPS
+
+CONSTANT_TYPES = (int, float, str, bytes, bool, type(None))  # complex values have no literal repr
+MAX_REPR = 32  # longer results are folded only if they are shorter than the expression
+# results bigger than this aren't even computed, the same limits as the AST optimizer of CPython uses
+MAX_INT_BITS = 128
+MAX_LENGTH = 4096
+SEQUENCE_TYPES = (str, bytes, tuple)
+
+
+def get_folded_ir(source) -> IR:
+    """
+    :param source: dis.Bytecode, function or code object
+    :return: IR of the folded instructions, folded only the first time
+    """
+    return fold(get_ir(source).code)
+
+
+@functools.lru_cache(maxsize=256)
+def fold(code: CodeType) -> IR:
+    ir = get_ir(code)
+    instructions = propagate(ir)
+    instructions = fold_operations(instructions)
+    instructions = fold_branches(instructions)
+    instructions = drop_unreachable(instructions)
+    return build(code, tuple(instructions))
+
+
+def is_constant(value) -> bool:
+    """
+    :return: whether the repr of the value evaluates back to it, the repr of inf or nan is a name
+    """
+    if isinstance(value, tuple):
+        return all(map(is_constant, value))
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, CONSTANT_TYPES)
+
+
+def load_const(instr: dis.Instruction, value) -> dis.Instruction:
+    """
+    :return: LOAD_CONST of the value in place of the instruction
+    """
+    return instr._replace(opname='LOAD_CONST', opcode=dis.opmap['LOAD_CONST'], arg=None,
+                          argval=value, argrepr=repr(value))
+
+
+def too_big(symbol: str, left, right) -> bool:
+    """
+    Estimates the size of the result before the operation is evaluated,
+    so 'ab' * 200000000 isn't built just to find out its repr is too long
+    """
+    if symbol == '*':
+        for sequence, times in ((left, right), (right, left)):
+            if isinstance(sequence, SEQUENCE_TYPES) and isinstance(times, int):
+                return len(sequence) * times > MAX_LENGTH
+        if isinstance(left, int) and isinstance(right, int):
+            return left.bit_length() + right.bit_length() > MAX_INT_BITS
+    if symbol == '+' and isinstance(left, SEQUENCE_TYPES) and isinstance(right, SEQUENCE_TYPES):
+        return len(left) + len(right) > MAX_LENGTH
+    if symbol == '%' and isinstance(left, (str, bytes)):  # printf-style formatting pads to the width in the format
+        text = left.decode('latin-1') if isinstance(left, bytes) else left
+        return '*' in text or any(int(width) > MAX_LENGTH for width in re.findall(r'\d+', text))
+    return False
+
+
+def jump_targets(instructions: list[dis.Instruction]) -> set[int]:
+    return {instr.argval for instr in instructions if instr.opname in JUMPS}
+
+
+def propagate(ir: IR) -> list[dis.Instruction]:
+    """
+    Replaces loads of variables which are stored only once, with a constant and in the first basic block,
+    so the store runs exactly once and before any load
+    """
+    instructions = list(ir.instructions)
+    entry_end = ir.blocks[0].end
+    stores = {}
+    for i, instr in enumerate(instructions):
+        if instr.opname == 'STORE_FAST':
+            stores.setdefault(instr.argval, []).append(i)
+
+    constants = {}
+    for name, indexes in stores.items():
+        i = indexes[0]
+        if len(indexes) == 1 and 0 < i < entry_end and instructions[i - 1].opname == 'LOAD_CONST' \
+                and is_constant(instructions[i - 1].argval):
+            constants[name] = i, instructions[i - 1].argval
+
+    for i, instr in enumerate(instructions):
+        if instr.opname == 'LOAD_FAST' and instr.argval in constants:
+            store, value = constants[instr.argval]
+            if store < i:
+                instructions[i] = load_const(instr, value)
+    return instructions
+
+
+def fold_operations(instructions: list[dis.Instruction]) -> list[dis.Instruction]:
+    """
+    Evaluates BINARY_OP and COMPARE_OP whose operands are both LOAD_CONST, results of folded operations
+    are constants themselves, so nested expressions fold as well. Operations which raise are left as is
+    """
+    targets = jump_targets(instructions)
+    folded = []
+    for instr in instructions:
+        symbol = instr.argrepr.replace('=', '')
+        if instr.opname == 'BINARY_OP':
+            op = BINARY_OPS.get(symbol)
+        elif instr.opname == 'COMPARE_OP':
+            op = COMPARE_OPS.get(instr.argrepr)
+        else:
+            op = None
+
+        operands = folded[-2:]
+        if op is None or len(operands) < 2 or any(operand.opname != 'LOAD_CONST' for operand in operands) \
+                or operands[1].offset in targets or instr.offset in targets:
+            folded.append(instr)
+            continue
+
+        left, right = operands[0].argval, operands[1].argval
+        if instr.opname == 'BINARY_OP' and too_big(symbol, left, right):
+            folded.append(instr)
+            continue
+        try:
+            value = op(left, right)
+        except Exception:
+            folded.append(instr)
+            continue
+        if not is_constant(value) or len(repr(value)) > max(MAX_REPR, len(f'{left!r} {instr.argrepr} {right!r}')):
+            folded.append(instr)
+            continue
+
+        del folded[-2:]
+        folded.append(load_const(operands[0], value))
+    return folded
+
+
+def fold_branches(instructions: list[dis.Instruction]) -> list[dis.Instruction]:
+    """
+    Conditional jumps on a constant either always jump, then they become JUMP_FORWARD,
+    or never jump, then they are removed together with the constant
+    """
+    targets = jump_targets(instructions)
+    folded = []
+    for instr in instructions:
+        if instr.opname not in ('POP_JUMP_FORWARD_IF_FALSE', 'POP_JUMP_FORWARD_IF_TRUE') or not folded \
+                or folded[-1].opname != 'LOAD_CONST' or instr.offset in targets:
+            folded.append(instr)
+            continue
+
+        const = folded.pop()
+        if bool(const.argval) == (instr.opname == 'POP_JUMP_FORWARD_IF_TRUE'):
+            folded.append(const._replace(opname='JUMP_FORWARD', opcode=dis.opmap['JUMP_FORWARD'], arg=None,
+                                         argval=instr.argval, argrepr=instr.argrepr))
+        elif const.offset in targets:
+            folded.append(const._replace(opname='NOP', opcode=dis.opmap['NOP'], arg=None, argval=None, argrepr=''))
+    return folded
+
+
+def drop_unreachable(instructions: list[dis.Instruction]) -> list[dis.Instruction]:
+    """
+    Removes instructions which can't be reached from the start and jumps to the very next instruction,
+    repeats while there is something to remove because removing one may make the other possible
+    """
+    while True:
+        index = {instr.offset: i for i, instr in enumerate(instructions)}
+        reachable = set()
+        pending = [0]
+        while pending:
+            i = pending.pop()
+            if i in reachable or i >= len(instructions):
+                continue
+            reachable.add(i)
+            instr = instructions[i]
+            if instr.opname in JUMPS:
+                pending.append(index[instr.argval])
+            if instr.opname not in UNCONDITIONAL_JUMPS and instr.opname not in TERMINATORS:
+                pending.append(i + 1)
+
+        kept = [instr for i, instr in enumerate(instructions) if i in reachable]
+        useless = [
+            i for i, instr in enumerate(kept)
+            if instr.opname == 'JUMP_FORWARD' and i + 1 < len(kept) and kept[i + 1].offset == instr.argval
+        ]
+        if not useless and len(kept) == len(instructions):
+            return kept
+        if useless:
+            # the jump lands on the next instruction anyway, so jumps to the jump may land there directly
+            i = useless[0]
+            kept = retarget(kept, kept[i].offset, kept[i + 1].offset)
+            del kept[i]
+        instructions = kept
+
+
+def retarget(instructions: list[dis.Instruction], old: int, new: int) -> list[dis.Instruction]:
+    return [
+        instr._replace(argval=new, argrepr=f'to {new}') if instr.opname in JUMPS and instr.argval == old else instr
+        for instr in instructions
+    ]
+
+
+if __name__ == '__main__':
+    from samples.sum import main as sample
+
+    for instr in get_folded_ir(sample).instructions:
+        print(instr.offset, instr.opname, instr.argrepr)
@@ -0,0 +1,137 @@
+"""
+Decoded representation of a code object shared by the virtual machine, decompiler and onelinerizer.
+Bytecode is decoded once per code object and the control flow is split into basic blocks
+and loop/if/else regions
+"""
+import dis
+import functools
+from dataclasses import dataclass
+from types import CodeType
+
+JUMPS = {dis.opname[op] for op in dis.hasjrel + dis.hasjabs}
+UNCONDITIONAL_JUMPS = {'JUMP_FORWARD', 'JUMP_BACKWARD', 'JUMP_BACKWARD_NO_INTERRUPT'}
+TERMINATORS = {'RETURN_VALUE', 'RAISE_VARARGS', 'RERAISE'}
+BRANCHES = {'POP_JUMP_FORWARD_IF_FALSE', 'POP_JUMP_FORWARD_IF_TRUE'}
+
+
+@dataclass(frozen=True, slots=True)
+class BasicBlock:
+    start: int  # index of the first instruction
+    end: int  # index after the last instruction
+    successors: tuple[int, ...]  # indexes of the blocks control can go to
+
+
+@dataclass(frozen=True, slots=True)
+class Region:
+    kind: str  # 'loop', 'if' or 'else'
+    header: int  # index of the instruction which opens the region
+    start: int  # offset of the first instruction inside the region
+    end: int  # offset where the region ends
+
+
+@dataclass(frozen=True)
+class IR:
+    code: CodeType
+    instructions: tuple[dis.Instruction, ...]
+    blocks: tuple[BasicBlock, ...]
+    regions: tuple[Region, ...]
+
+
+def get_ir(source) -> IR:
+    """
+    :param source: dis.Bytecode, function or code object
+    :return: IR of the code object, decoded only the first time
+    """
+    if isinstance(source, dis.Bytecode):
+        return decode(source.codeobj)
+    return decode(getattr(source, '__code__', source))
+
+
+@functools.lru_cache(maxsize=256)
+def decode(code: CodeType) -> IR:
+    return build(code, tuple(dis.get_instructions(code)))
+
+
+def build(code: CodeType, instructions: tuple[dis.Instruction, ...]) -> IR:
+    """
+    :param instructions: instructions of the code, possibly rewritten, every jump has to land on one of them
+    """
+    index = {instr.offset: i for i, instr in enumerate(instructions)}
+    targets = tuple(index[instr.argval] if instr.opname in JUMPS else None for instr in instructions)
+    return IR(code, instructions, find_blocks(instructions, targets), find_regions(instructions))
+
+
+def find_blocks(instructions: tuple[dis.Instruction, ...], targets: tuple[int | None, ...]) -> tuple[BasicBlock, ...]:
+    leaders = {0}
+    for i, instr in enumerate(instructions):
+        if targets[i] is not None:
+            leaders.add(targets[i])
+        if targets[i] is not None or instr.opname in TERMINATORS:
+            leaders.add(i + 1)
+    leaders = sorted(leader for leader in leaders if leader < len(instructions))
+    block_of = {leader: n for n, leader in enumerate(leaders)}
+
+    blocks = []
+    for n, start in enumerate(leaders):
+        end = leaders[n + 1] if n + 1 < len(leaders) else len(instructions)
+        last = instructions[end - 1]
+        successors = []
+        if last.opname not in UNCONDITIONAL_JUMPS and last.opname not in TERMINATORS and end < len(instructions):
+            successors.append(n + 1)
+        if targets[end - 1] is not None:
+            successors.append(block_of[targets[end - 1]])
+        blocks.append(BasicBlock(start, end, tuple(successors)))
+    return tuple(blocks)
+
+
+def find_regions(instructions: tuple[dis.Instruction, ...]) -> tuple[Region, ...]:
+    """
+    Regions are properly nested, so they are tracked with a stack while going through the instructions,
+    a region never ends later than the one around it.
+    A jump at the very end of an if region means that the code after it is the else branch:
+    JUMP_FORWARD jumps over it, JUMP_BACKWARD goes to the start of the innermost loop and the else lasts
+    till the loop end. Else regions nested in the if which end right after the jump end with it
+    """
+    regions = []
+    opened: list[Region] = []
+    for i, instr in enumerate(instructions):
+        while opened and instr.offset >= opened[-1].end:
+            opened.pop()
+
+        next_offset = instructions[i + 1].offset if i + 1 < len(instructions) else None
+        kind = end = None
+        if instr.opname == 'FOR_ITER':
+            kind, end = 'loop', instr.argval
+        elif instr.opname in BRANCHES:
+            kind, end = 'if', instr.argval
+        elif instr.opname in ('JUMP_FORWARD', 'JUMP_BACKWARD'):
+            k = len(opened)
+            while k and opened[k - 1].kind == 'else' and opened[k - 1].end == next_offset:
+                k -= 1
+            if k and opened[k - 1].kind == 'if' and opened[k - 1].end == next_offset:
+                if instr.opname == 'JUMP_FORWARD':
+                    end = instr.argval
+                else:
+                    end = next((region.end for region in reversed(opened[:k - 1]) if region.kind == 'loop'), None)
+                if end is not None:
+                    kind = 'else'
+                    del opened[k - 1:]
+
+        if kind is not None:
+            if opened:
+                end = min(end, opened[-1].end)
+            region = Region(kind, i, next_offset, end)
+            regions.append(region)
+            opened.append(region)
+
+    return tuple(regions)
+
+
+if __name__ == '__main__':
+    from samples.simple_game import main as sample
+
+    ir = get_ir(sample)
+    for block in ir.blocks:
+        print(block, [ir.instructions[i].opname for i in range(block.start, block.end)])
+    for region in ir.regions:
+        print(region)
@@ -0,0 +1,152 @@
+"""
+Liveness analysis for the onelinerizer, every STORE_FAST costs a lambda or a walrus there.
+Stores whose value is never read afterwards are dropped, the value is still evaluated unless it's
+a plain load. Variables which are stored once and read once right after, with only loads in between,
+are inlined: STORE_FAST and LOAD_FAST become STORE_TEMP and LOAD_TEMP, which pass the expression
+from one to the other without binding anything
+"""
+import dis
+import functools
+from types import CodeType
+
+from folding import fold
+from ir import IR, JUMPS, build, get_ir
+
+STORES = {'STORE_FAST'}
+LOADS = {'LOAD_FAST'}
+# instructions which only push a value, an inlined expression may be moved over them
+PURE = {'LOAD_CONST', 'LOAD_FAST', 'LOAD_GLOBAL', 'PUSH_NULL', 'NOP'}
+
+
+def get_pruned_ir(source, folded: bool = False) -> IR:
+    """
+    :param source: dis.Bytecode, function or code object
+    :param folded: run the folding pass first
+    :return: IR without dead stores and with single-use variables inlined, pruned only the first time
+    """
+    return prune(get_ir(source).code, folded)
+
+
+@functools.lru_cache(maxsize=256)
+def prune(code: CodeType, folded: bool = False) -> IR:
+    ir = fold(code) if folded else get_ir(code)
+    instructions = list(ir.instructions)
+    protected = bound_by_header(instructions)
+
+    live_after = live_variables(ir)
+    dead = {
+        i for i, instr in enumerate(instructions)
+        if instr.opname in STORES and i not in protected and instr.argval not in live_after[i]
+    }
+    temps = single_use(ir, protected, dead)
+
+    pruned = []
+    jumped_to = {instr.argval for instr in instructions if instr.opname in JUMPS}
+    for i, instr in enumerate(instructions):
+        if i in dead:
+            value = pruned[-1] if pruned else None
+            if value is not None and value.opname in ('LOAD_CONST', 'LOAD_FAST') and instr.offset not in jumped_to:
+                # nothing to evaluate, a jump target keeps its offset as NOP
+                pruned.pop()
+                if value.offset in jumped_to:
+                    pruned.append(value._replace(opname='NOP', opcode=dis.opmap['NOP'], arg=None,
+                                                 argval=None, argrepr=''))
+            else:
+                pruned.append(instr._replace(opname='POP_TOP', opcode=dis.opmap['POP_TOP'], arg=None,
+                                             argval=None, argrepr=''))
+        elif instr.opname in STORES and instr.argval in temps:
+            pruned.append(instr._replace(opname='STORE_TEMP'))
+        elif instr.opname in LOADS and instr.argval in temps:
+            pruned.append(instr._replace(opname='LOAD_TEMP'))
+        else:
+            pruned.append(instr)
+    return build(code, tuple(pruned))
+
+
+def bound_by_header(instructions: list[dis.Instruction]) -> set[int]:
+    """
+    Stores which are part of a for header or an unpacking, the onelinerizer reads them together with
+    FOR_ITER or UNPACK_SEQUENCE, so they have to stay
+    """
+    protected = set()
+    for i, instr in enumerate(instructions):
+        if instr.opname == 'FOR_ITER':
+            protected.add(i + 1)
+        if instr.opname == 'UNPACK_SEQUENCE':
+            protected.update(range(i + 1, i + 1 + instr.argval))
+    return protected
+
+
+def live_variables(ir: IR) -> list[set[str]]:
+    """
+    Backward data flow over the basic blocks
+    :return: variables which may be read later, for the point right after every instruction
+    """
+    live_in = [set() for _ in ir.blocks]
+    changed = True
+    while changed:
+        changed = False
+        for n in reversed(range(len(ir.blocks))):
+            block = ir.blocks[n]
+            live = set().union(*(live_in[s] for s in block.successors))
+            for instr in reversed(ir.instructions[block.start:block.end]):
+                live = transfer(instr, live)
+            if live != live_in[n]:
+                live_in[n] = live
+                changed = True
+
+    live_after = [set() for _ in ir.instructions]
+    for block in ir.blocks:
+        live = set().union(*(live_in[s] for s in block.successors))
+        for i in reversed(range(block.start, block.end)):
+            live_after[i] = live
+            live = transfer(ir.instructions[i], live)
+    return live_after
+
+
+def transfer(instr: dis.Instruction, live: set[str]) -> set[str]:
+    if instr.opname in STORES:
+        return live - {instr.argval}
+    if instr.opname in LOADS:
+        return live | {instr.argval}
+    return live
+
+
+def single_use(ir: IR, protected: set[int], dead: set[int]) -> set[str]:
+    """
+    :param protected: indexes of stores which can't be inlined
+    :param dead: indexes of dead stores, they are dropped, so they neither count nor stand in the way
+    :return: variables which are stored and read exactly once, in the same basic block with only
+        pure instructions between, so inlining the expression doesn't reorder any side effects
+    """
+    stores, loads = {}, {}
+    for i, instr in enumerate(ir.instructions):
+        if i in dead:
+            continue
+        if instr.opname in STORES:
+            stores.setdefault(instr.argval, []).append(i)
+        elif instr.opname in LOADS:
+            loads.setdefault(instr.argval, []).append(i)
+
+    block_of = {}
+    for n, block in enumerate(ir.blocks):
+        for i in range(block.start, block.end):
+            block_of[i] = n
+
+    temps = set()
+    for name, indexes in stores.items():
+        if len(indexes) != 1 or len(loads.get(name, ())) != 1 or indexes[0] in protected:
+            continue
+        store, load = indexes[0], loads[name][0]
+        between = range(store + 1, load)
+        if store < load and block_of[store] == block_of[load] \
+                and all(ir.instructions[i].opname in PURE or i in dead for i in between):
+            temps.add(name)
+    return temps
+
+
+if __name__ == '__main__':
+    from samples.simple_game import main as sample
+
+    for instr in get_pruned_ir(sample).instructions:
+        print(instr.offset, instr.opname, instr.argrepr)
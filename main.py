@@ -1,5 +1,6 @@
 import dis
 from dataclasses import dataclass
+from ir import get_ir
 
 
 @dataclass
@@ -8,14 +9,18 @@ class Indent:
     ending: str
 
 
-def linerize(bytecode: dis.Bytecode):
+def onelinerize(bytecode: dis.Bytecode) -> str:
+    """
+    :return: the one-liner, endings are only known at the very end, so this one can't stream it
+    """
     stack_names = []  # names of variables and functions used
 
-    start = '(lambda: ['
-    end = '][-1])()'
+    # fragments are only appended and joined once at the end, `end` is kept reversed
+    start = ['(lambda: [']
+    end = ['][-1])()']
 
     instr_i = 0
-    instructions = list(bytecode)
+    instructions = get_ir(bytecode).instructions
 
     indents: list[Indent] = []
 
@@ -26,7 +31,7 @@ def linerize(bytecode: dis.Bytecode):
         # indents.sort(reverse=True, key=lambda x: x.line_to)
         # not cool for large number of elems, but I'm sure noone has more than 6-7 indents
         while len(indents) != 0 and instr.offset >= indents[-1].line_to:
-            end = indents.pop().ending + end
+            end.append(indents.pop().ending)
 
         match instr.opname:
             case 'RESUME': continue
@@ -35,11 +40,11 @@ def linerize(bytecode: dis.Bytecode):
             case 'BUILD_LIST': stack_names.append(list())
             case 'BUILD_TUPLE': stack_names.append(tuple())
             case 'RETURN_VALUE':
-                start += str(stack_names.pop()) + ', '  # + indents.pop().ending  # + '][-1], ['  # edit
+                start.append(str(stack_names.pop()) + ', ')  # + indents.pop().ending  # + '][-1], ['  # edit
                 # print(stack_names.pop(), end=',\n')
                 # print('return', stack_names.pop())
             case 'POP_TOP':
-                start += stack_names.pop() + ', '
+                start.append(stack_names.pop() + ', ')
                 # print(stack_names.pop(), end=',\n')
 
             case 'BUILD_CONST_KEY_MAP':
@@ -65,8 +70,8 @@ def linerize(bytecode: dis.Bytecode):
                 else:
                     stack_names.append(instr.argrepr)
             case 'STORE_FAST':
-                start = start + f'(lambda {instr.argval}: ['
-                end = f'][-1])({stack_names.pop()})' + end
+                start.append(f'(lambda {instr.argval}: [')
+                end.append(f'][-1])({stack_names.pop()})')
                 # print(f'{instr.argval} = {stack_names.pop()}')
             case 'LOAD_FAST':
                 stack_names.append(instr.argval)
@@ -84,7 +89,7 @@ def linerize(bytecode: dis.Bytecode):
             case 'FOR_ITER':  # fixme doesnt take indentation into account
                 next_instr = instructions[instr_i]
                 instr_i += 1
-                start += '[['
+                start.append('[[')
                 if next_instr.opname == 'UNPACK_SEQUENCE':
                     iter_name = []
                     for _ in range(next_instr.argval):
@@ -95,7 +100,7 @@ def linerize(bytecode: dis.Bytecode):
                 else:
                     iter_name = next_instr.argval
                 # print(f'for {iter_name} in {stack_names.pop()}:')
-                end = f'][-1] for {iter_name} in {stack_names.pop()}][-1]' + end
+                end.append(f'][-1] for {iter_name} in {stack_names.pop()}][-1]')
                 # indents.append(Indent(instr.argval, f'][-1] for {iter_name} in {stack_names.pop()}][-1]'))
                 # indents.append(Indent(instr.argval, f''))
                 # try:
@@ -110,7 +115,7 @@ def linerize(bytecode: dis.Bytecode):
             case 'JUMP_FORWARD':
                 ...
                 # print('\t' * (len(indents) - 1) + 'else:')  # TODO this is a workaround
-                start += '][-1]), False: (lambda: ['
+                start.append('][-1]), False: (lambda: [')
                 indents.append(Indent(instr.argval, ''))
             case 'BINARY_OP':
                 sn = stack_names.pop()  # for some reason operands are reversed
@@ -152,18 +157,22 @@ def linerize(bytecode: dis.Bytecode):
             case 'POP_JUMP_FORWARD_IF_FALSE':
                 # I can probably use ternary operators, but in that case I'll have to deal
                 # with inserting the if-statement into the middle
-                start += '{True: (lambda: ['
+                start.append('{True: (lambda: [')
                 # end = f'][-1])}}.get({stack_names.pop()}, lambda: None)()' + end
                 indents.append(Indent(instr.argval, f'][-1])}}.get({stack_names.pop()}, lambda: None)()'))
             case 'POP_JUMP_FORWARD_IF_TRUE':
-                start += '{True: (lambda: ['
+                start.append('{True: (lambda: [')
                 # end = f'][-1])}}.get(not {stack_names.pop()}, lambda: None)()' + end
                 indents.append(Indent(instr.argval, f'][-1])}}.get(not {stack_names.pop()}, lambda: None)()'))
             case _:
                 raise ValueError(f'Unknown opname: {instr.opname}')
         # print(instr.opname, repr(instr.argval))
 
-    print(start + end)
+    return ''.join(start) + ''.join(reversed(end))
+
+
+def linerize(bytecode: dis.Bytecode):
+    print(onelinerize(bytecode))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,233 @@
+"""
+Makes one-liners as small as possible: local names are shortened, list wrappers around a single
+expression are dropped, parentheses are only kept where needed and whitespace is removed.
+The minified code is checked by running it next to the original one-liner
+
+Usage:
+    python minify.py PROGRAM.py [--function main] [--walrus] [--fold] [--inline] [--stdin FILE] [--seed N]
+
+Prints the minified one-liner, the report goes to stderr, exits with 1 if the results differ
+"""
+import argparse
+import ast
+import builtins
+import contextlib
+import dis
+import io
+import itertools
+import keyword
+import random
+import string
+import sys
+import tokenize
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+
+import clean_main
+
+SEPARATED = {tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER, tokenize.INDENT, tokenize.DEDENT}
+
+
+@dataclass
+class Report:
+    original_bytes: int
+    minified_bytes: int
+    equivalent: bool | None = None  # None if it wasn't checked
+
+    @property
+    def saved(self) -> int:
+        return self.original_bytes - self.minified_bytes
+
+    def __str__(self):
+        text = (f'{self.original_bytes} -> {self.minified_bytes} bytes, '
+                f'saved {self.saved} ({self.saved / self.original_bytes:.1%})')
+        if self.equivalent is not None:
+            text += ', equivalent' if self.equivalent else ', NOT equivalent'
+        return text
+
+
+class Unwrap(ast.NodeTransformer):
+    """
+    [expression][-1] is the expression itself and for loops don't need iter() around the iterable
+    """
+
+    def __init__(self, bound: set[str]):
+        self.bound = bound  # if iter is bound, it's not the builtin
+
+    def visit_comprehension(self, node: ast.comprehension):
+        self.generic_visit(node)
+        call = node.iter
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == 'iter' \
+                and 'iter' not in self.bound and len(call.args) == 1 and not call.keywords:
+            node.iter = call.args[0]
+        return node
+
+    def visit_Subscript(self, node: ast.Subscript):
+        self.generic_visit(node)
+        index = node.slice
+        if isinstance(node.value, ast.List) and len(node.value.elts) == 1 \
+                and isinstance(index, ast.UnaryOp) and isinstance(index.op, ast.USub) \
+                and isinstance(index.operand, ast.Constant) and index.operand.value == 1:
+            return node.value.elts[0]
+        return node
+
+
+class Unparser(ast._Unparser):
+    """
+    ast.unparse with a generator which is the only argument of a call written without its own parentheses,
+    any(x for x in y) instead of any((x for x in y)). The ast is the same, only unparse adds them
+    """
+
+    def visit_Call(self, node: ast.Call):
+        if len(node.args) != 1 or node.keywords or not isinstance(node.args[0], ast.GeneratorExp):
+            return super().visit_Call(node)
+        self.set_precedence(ast._Precedence.ATOM, node.func)
+        self.traverse(node.func)
+        with self.delimit('(', ')'):
+            self.traverse(node.args[0].elt)
+            for generator in node.args[0].generators:
+                self.traverse(generator)
+
+
+class Rename(ast.NodeTransformer):
+    def __init__(self, names: dict[str, str]):
+        self.names = names
+
+    def visit_Name(self, node: ast.Name):
+        node.id = self.names.get(node.id, node.id)
+        return node
+
+    def visit_arg(self, node: ast.arg):
+        node.arg = self.names.get(node.arg, node.arg)
+        return node
+
+
+def bound_names(tree: ast.AST) -> Counter:
+    """
+    :return: names bound by lambdas, walruses and comprehensions with the number of their uses
+    """
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, ast.NamedExpr):
+            bound.add(node.target.id)
+        elif isinstance(node, ast.comprehension):
+            bound.update(name.id for name in ast.walk(node.target) if isinstance(name, ast.Name))
+
+    uses = Counter()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in bound:
+            uses[node.id] += 1
+        elif isinstance(node, ast.arg):
+            uses[node.arg] += 1
+    return uses
+
+
+def short_names():
+    first = string.ascii_letters + '_'
+    for length in itertools.count(1):
+        for chars in itertools.product(first, repeat=length):
+            name = ''.join(chars)
+            if not keyword.iskeyword(name):
+                yield name
+
+
+def shorten(tree: ast.AST) -> dict[str, str]:
+    """
+    Renaming every bound name to a name which isn't used anywhere in the code can't make two names
+    collide, no matter which scopes they are in. The most used names get the shortest ones
+    :return: map from the old names to the new ones
+    """
+    bound = bound_names(tree)
+    taken = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and node.id not in bound}
+    fresh = (name for name in short_names() if name not in taken)
+    return {name: next(fresh) for name, _ in bound.most_common()}
+
+
+def compact(source: str) -> str:
+    """
+    Joins the tokens back leaving spaces only between names, keywords and numbers
+    """
+    parts = []
+    previous = None
+    for token in tokenize.generate_tokens(io.StringIO(source).readline):
+        if token.type in SEPARATED:
+            continue
+        text = token.string
+        if previous is not None:
+            glued = previous.string[-1].isalnum() or previous.string[-1] == '_'
+            if glued and (text[0].isalnum() or text[0] == '_') or previous.type == tokenize.NUMBER and text[0] == '.':
+                parts.append(' ')
+        parts.append(text)
+        previous = token
+    return ''.join(parts)
+
+
+def minify(source: str) -> str:
+    """
+    :param source: one-liner from the onelinerizer
+    """
+    tree = ast.parse(source)
+    tree = Unwrap(set(bound_names(tree))).visit(tree)
+    tree = Rename(shorten(tree)).visit(tree)
+    return compact(Unparser().visit(tree))
+
+
+def run(source: str, stdin: str = '', seed: int = 0) -> tuple[str, str | None]:
+    """
+    Runs the code with the given input and seeded random
+    :return: printed output and the exception it raised, if any
+    """
+    old_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
+    random.seed(seed)
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            try:
+                exec(source, {'__builtins__': builtins})
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+    finally:
+        sys.stdin = old_stdin
+    return output.getvalue(), error
+
+
+def verify(original: str, minified: str, stdin: str = '', seed: int = 0) -> bool:
+    return run(original, stdin, seed) == run(minified, stdin, seed)
+
+
+def main(argv: list[str] = None):
+    from batch import find_functions
+
+    parser = argparse.ArgumentParser(description='Onelinerize a function and minify the one-liner')
+    parser.add_argument('program', type=Path)
+    parser.add_argument('--function', default='main', help='name of the function to onelinerize')
+    parser.add_argument('--walrus', action='store_true', help='bind variables with assignment expressions')
+    parser.add_argument('--fold', action='store_true', help='evaluate constant expressions and drop dead branches')
+    parser.add_argument('--inline', action='store_true', help='drop dead stores and inline single-use variables')
+    parser.add_argument('--stdin', type=Path, help='input for the verification runs')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the verification runs')
+    args = parser.parse_args(argv)
+
+    code = compile(args.program.read_text(), str(args.program), 'exec')
+    functions = list(find_functions(code, args.function))
+    if not functions:
+        parser.error(f'{args.function} is not defined in {args.program}')
+
+    original = clean_main.onelinerize(dis.Bytecode(functions[0]), walrus=args.walrus, fold=args.fold,
+                                      inline=args.inline)
+    minified = minify(original)
+    stdin = args.stdin.read_text() if args.stdin else ''
+    report = Report(len(original.encode()), len(minified.encode()), verify(original, minified, stdin, args.seed))
+
+    print(minified)
+    print(report, file=sys.stderr)
+    if not report.equivalent:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,12 +2,176 @@
 # and I want to keep all opcodes synced and in case if I found a bug in one of them, I want to fix it in all of them
 # because usually bugs are caused by misunderstanding of the documentation, and it is general for all "projects".
 # Moreover, opcodes in all "projects" sometimes share the similar logic so it's also cool for the sake of reusing code
+import cmath
+import heapq
+import math
+import operator
+import sys
 from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
 from dis import Instruction
+from types import CellType
+
+
+BINARY_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '%': operator.mod,
+    '//': operator.floordiv
+}
+
+COMPARE_OPS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge
+}
+
+
+class Unbound:
+    """
+    Value of a fast local which wasn't assigned yet, None is a perfectly fine value for a variable
+    """
+
+    def __repr__(self):
+        return 'UNBOUND'
+
+    def __reduce__(self):
+        return 'UNBOUND'  # pickled as a reference to the module global, so it stays the only instance
+
+
+UNBOUND = Unbound()
+IMMUTABLE_TYPE = 1 << 8  # Py_TPFLAGS_IMMUTABLETYPE, attributes of such types can't be changed
+RETURNED = sys.maxsize  # index of a frame after RETURN_VALUE, past the end of any program so every loop stops
+
+
+class InlineCache:
+    """
+    Per-instruction cache kept in the operand of the decoded instruction. Only misses are counted,
+    so hits cost nothing extra, the profiler gets hits from the number of executions
+    """
+    __slots__ = ('name', 'misses')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.misses = 0
+
+
+class GlobalCache(InlineCache):
+    """
+    Scope of a global or builtin, see virtual_machine.Namespace. The value is read live from the scope every time,
+    the scope is valid while the version of the namespace is the same and, for a builtin, while the module globals
+    have the same size, so a global which shadows it is noticed. A global added while another one is deleted
+    between two executions keeps the size and isn't noticed
+    """
+    __slots__ = ('version', 'scope', 'size')
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.version = None
+        self.scope = 0
+        self.size = 0
+
+
+class MethodCache(InlineCache):
+    """
+    Method of the type of the last receiver, bound to every receiver on its own. Only immutable types without
+    instance __dict__ and custom attribute lookup are cached, their methods can't change or be shadowed.
+    Neither the receiver nor the bound method is kept, so the cache doesn't keep objects alive
+    """
+    __slots__ = ('type', 'bind')
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.type = UNBOUND
+        self.bind = None
+
+
+def method_binder(cls: type, name: str):
+    """
+    :return: function binding the method of the type to a receiver, None if the type can't be cached, see MethodCache
+    """
+    if (not cls.__flags__ & IMMUTABLE_TYPE or cls.__dictoffset__
+            or cls.__getattribute__ is not object.__getattribute__):
+        return None
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            method = klass.__dict__[name]
+            get = getattr(type(method), '__get__', None)
+            return (lambda receiver: method) if get is None else get.__get__(method)
+    return None
+
+
+@dataclass
+class Indent:
+    """
+    Block opened by the onelinerizer, it is closed once the instruction at line_to offset is reached
+    """
+    line_to: float
+    ending: str
+    else_start: str = None  # replaces the ending if the block turns out to have an else branch
+    ends: list[str] = field(default_factory=list)  # endings of lambdas opened inside the block, reversed
+    loop: bool = False  # opened by a for loop, its ending is the for clause of the comprehension
+    flag: str = None  # loops only, list made for every iteration which a continue marks, see continue_flag
+    guard: str = None  # the code after the block runs only while this flag is empty
+
+    def close(self) -> str:
+        return ''.join(reversed(self.ends)) + self.ending
+
+
+def start_else(indents: list[Indent], next_offset: int, line_to: float) -> str:
+    """
+    Jump at the very end of an if block means that the code after it is the else branch,
+    so the if block is closed with its else_start and replaced with the else block.
+    Else blocks nested in the if which end at the same jump are closed first,
+    and the new else block never lasts longer than the block around the if
+    :return: string to append to the start
+    """
+    i = len(indents) - 1
+    while i > 0 and indents[i].else_start is None and not indents[i].loop and indents[i].line_to == next_offset:
+        i -= 1
+    branch = indents[i]
+    if branch.else_start is None or branch.line_to != next_offset:
+        return ''
+
+    closed = indents[i + 1:]
+    del indents[i:]
+    indents.append(Indent(min(line_to, indents[-1].line_to), '][-1]), ', guard=branch.guard))
+    return ''.join(block.close() for block in reversed(closed)) + ''.join(reversed(branch.ends)) + branch.else_start
+
+
+def fresh_name(name: str, instructions: list[Instruction]) -> str:
+    """
+    :return: the name with underscores appended until no instruction of the code uses it
+    """
+    taken = {instr.argval for instr in instructions if isinstance(instr.argval, str)}
+    name += '_'
+    while name in taken:
+        name += '_'
+    return name
+
+
+def continue_flag(loop: Indent, instructions: list[Instruction]) -> str:
+    """
+    A continue inside a block nested in the loop body can't be an else of its if alone, the code after
+    the blocks around it has to be skipped as well. The comprehension of the loop gets one more clause which
+    makes an empty list for every iteration, the continue appends to it and the code after those blocks
+    only runs while it's empty
+    :return: name of the list
+    """
+    if loop.flag is None:
+        loop.flag = fresh_name('continued', instructions)
+        loop.ending = loop.ending.removesuffix('), ') + f' for {loop.flag} in [[]]), '
+    return loop.flag
 
 
 class InstructionABC(ABC):
     NAME = 'ABSTRACT_INSTRUCTION'
+    VM_NOOP = False  # does nothing on VM, so the decoded program doesn't need it at all
 
     def __init__(self,
                  instr: Instruction,
@@ -24,7 +188,7 @@ class InstructionABC(ABC):
         :param stack: stack from VM or decompiler
         :param co_varnames: dict of variables from VM or decompiler
         :param current_index: current index of the instruction
-        :param indents: list of indents from decompiler
+        :param indents: heap of block end offsets from decompiler or list of Indent from onelinerizer
         :param next_instrs: list of instructions from decompiler
 
         index is the index after the instruction is executed
@@ -59,6 +223,35 @@ class InstructionABC(ABC):
         """
         pass
 
+    def execute_onelinerizer_walrus(self) -> tuple[str, str]:
+        """
+        Method to execute the instruction on onelinerizer in flat mode, where variables are bound
+        with assignment expressions instead of nested lambdas. Same as execute_onelinerizer for
+        everything which doesn't bind variables
+        :return: tuple of strings to append to the start and end
+        """
+        return self.execute_onelinerizer()
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        """
+        Prepares the operand for vm_handler, called once per instruction before the VM starts
+        :param instr: instruction from dis
+        :param targets: map from instruction offset to its index in the decoded program
+        :return: operand passed to vm_handler on every execution
+        """
+        return instr.argval
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        """
+        Stateless version of execute_vm used by the decoded VM loop, it works on the shared frame
+        instead of creating an object for every executed instruction
+        :param frame: Frame from VM
+        :param arg: operand returned by decode_arg
+        """
+        raise NotImplementedError
+
 
 class PopTop(InstructionABC):
     NAME = 'POP_TOP'
@@ -72,6 +265,10 @@ class PopTop(InstructionABC):
     def execute_onelinerizer(self) -> tuple[str, str]:
         return self.stack.pop() + ', ', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.stack.pop()
+
 
 class Return(InstructionABC):
     NAME = 'RETURN_VALUE'
@@ -85,25 +282,66 @@ class Return(InstructionABC):
     def execute_onelinerizer(self) -> tuple[str, str]:
         return str(self.stack.pop()) + ', ', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.retval = frame.stack.pop()
+        frame.index = RETURNED
+
 
 class Resume(InstructionABC):
     NAME = 'RESUME'
+    VM_NOOP = True
     def execute_vm(self): pass
     def execute_decompiler(self) -> str: return ''
     def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    @staticmethod
+    def vm_handler(frame, arg): pass
 
 
 class Nop(InstructionABC):
     NAME = 'NOP'
+    VM_NOOP = True
     def execute_vm(self): pass
     def execute_decompiler(self) -> str: return ''
+    def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    @staticmethod
+    def vm_handler(frame, arg): pass
 
 
 class Precall(InstructionABC):
     NAME = 'PRECALL'
+    VM_NOOP = True
+    def execute_vm(self): pass
+    def execute_decompiler(self) -> str: return ''
+    def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    @staticmethod
+    def vm_handler(frame, arg): pass
+
+
+class PushNull(InstructionABC):
+    """
+    Callables loaded on VM are never preceded by NULL, so there is nothing to push
+    """
+    NAME = 'PUSH_NULL'
+    VM_NOOP = True
     def execute_vm(self): pass
     def execute_decompiler(self) -> str: return ''
     def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    @staticmethod
+    def vm_handler(frame, arg): pass
+
+
+class ExtendedArg(InstructionABC):
+    """
+    dis already adds the extended part to the argument of the next instruction, so it does nothing
+    """
+    NAME = 'EXTENDED_ARG'
+    VM_NOOP = True
+    def execute_vm(self): pass
+    def execute_decompiler(self) -> str: return ''
+    def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    @staticmethod
+    def vm_handler(frame, arg): pass
 
 
 class BuildList(InstructionABC):
@@ -120,6 +358,13 @@ class BuildList(InstructionABC):
         self.execute_vm()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        items = stack[len(stack) - arg:]
+        del stack[len(stack) - arg:]
+        stack.append(items)
+
 
 class BuildTuple(InstructionABC):
     NAME = 'BUILD_TUPLE'
@@ -135,6 +380,13 @@ class BuildTuple(InstructionABC):
         self.execute_vm()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        items = tuple(stack[len(stack) - arg:])
+        del stack[len(stack) - arg:]
+        stack.append(items)
+
 
 class BuildConstKeyMap(InstructionABC):
     NAME = 'BUILD_CONST_KEY_MAP'
@@ -160,6 +412,14 @@ class BuildConstKeyMap(InstructionABC):
         )
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        keys = stack.pop()
+        values = stack[len(stack) - len(keys):]
+        del stack[len(stack) - len(keys):]
+        stack.append(dict(zip(keys, values)))
+
 
 class ImportName(InstructionABC):
     NAME = 'IMPORT_NAME'
@@ -175,6 +435,13 @@ class ImportName(InstructionABC):
         self.stack.append(f'__import__("{self.instr.argval}")')
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        fromlist = stack.pop()
+        level = stack.pop()
+        stack.append(__import__(arg, fromlist=fromlist, level=level))
+
 
 class ListExtend(InstructionABC):
     NAME = 'LIST_EXTEND'
@@ -191,6 +458,11 @@ class ListExtend(InstructionABC):
         self.execute_vm()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        seq = frame.stack.pop()
+        frame.stack[-arg].extend(seq)
+
 
 class BinarySubscr(InstructionABC):
     NAME = 'BINARY_SUBSCR'
@@ -208,6 +480,12 @@ class BinarySubscr(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        ind = stack.pop()
+        stack[-1] = stack[-1][ind]
+
 
 class UnpackSequence(InstructionABC):
     NAME = 'UNPACK_SEQUENCE'
@@ -225,6 +503,26 @@ class UnpackSequence(InstructionABC):
         self.execute_vm()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.stack.extend(frame.stack.pop()[::-1])
+
+
+def literal(instr: Instruction) -> str:
+    """
+    :return: source of the constant, inf and nan have no literal, the compiler makes them from 1e308 * 10 and the like
+    """
+    value = instr.argval
+    if isinstance(value, float):
+        return float_literal(value)
+    if isinstance(value, complex) and not cmath.isfinite(value):
+        return f'complex({float_literal(value.real)}, {float_literal(value.imag)})'
+    return instr.argrepr
+
+
+def float_literal(value: float) -> str:
+    return repr(value) if math.isfinite(value) else f"float('{value!r}')"
+
 
 class LoadConst(InstructionABC):
     NAME = 'LOAD_CONST'
@@ -236,16 +534,20 @@ class LoadConst(InstructionABC):
         if type(self.instr.argval) in (list, tuple):
             self.stack.append(self.instr.argval)
         else:
-            self.stack.append(self.instr.argrepr)
+            self.stack.append(literal(self.instr))
         return ''
 
     def execute_onelinerizer(self) -> tuple[str, str]:
         if type(self.instr.argval) in (list, tuple):
             self.stack.append(self.instr.argval)
         else:
-            self.stack.append(self.instr.argrepr)
+            self.stack.append(literal(self.instr))
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.stack.append(arg)
+
 
 class StoreFast(InstructionABC):
     NAME = 'STORE_FAST'
@@ -262,6 +564,17 @@ class StoreFast(InstructionABC):
             f'][-1])({self.stack.pop()})'
         )
 
+    def execute_onelinerizer_walrus(self) -> tuple[str, str]:
+        return f'({self.instr.argval} := {self.stack.pop()}), ', ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.locals[arg] = frame.stack.pop()
+
 
 class LoadFast(InstructionABC):
     NAME = 'LOAD_FAST'
@@ -279,6 +592,66 @@ class LoadFast(InstructionABC):
         self.stack.append(self.instr.argval)
         return '', ''
 
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        value = frame.locals[arg]
+        if value is UNBOUND:
+            raise UnboundLocalError(f'Variable {frame.varnames[arg]} not defined')
+        frame.stack.append(value)
+
+
+class StoreTemp(InstructionABC):
+    """
+    STORE_FAST of a variable which is read only once right after, liveness replaces it with this instruction
+    and the expression is put in place of the LOAD_TEMP instead of binding the variable
+    """
+    NAME = 'STORE_TEMP'
+
+    def execute_vm(self): raise NotImplementedError
+
+    @staticmethod
+    def parenthesize(value: str) -> str:
+        """
+        Parentheses keep the expression whole wherever it's put, unless it's a single token or already wrapped
+        """
+        if ' ' not in value:
+            return value
+        depth = 0
+        for i, char in enumerate(value):
+            depth += (char == '(') - (char == ')')
+            if depth == 0:
+                return value if i == len(value) - 1 and value[0] == '(' else f'({value})'
+        return f'({value})'
+
+    def execute_decompiler(self) -> str:
+        self.co_varnames[self.instr.argval] = self.parenthesize(str(self.stack.pop()))
+        return ''
+
+    def execute_onelinerizer(self) -> tuple[str, str]:
+        self.execute_decompiler()
+        return '', ''
+
+    def execute_onelinerizer_walrus(self) -> tuple[str, str]:
+        return self.execute_onelinerizer()
+
+
+class LoadTemp(InstructionABC):
+    NAME = 'LOAD_TEMP'
+
+    def execute_vm(self): raise NotImplementedError
+
+    def execute_decompiler(self) -> str:
+        self.stack.append(self.co_varnames.pop(self.instr.argval))
+        return ''
+
+    def execute_onelinerizer(self) -> tuple[str, str]:
+        self.execute_decompiler()
+        return '', ''
+
 
 class StoreName(InstructionABC):
     NAME = 'STORE_NAME'
@@ -289,6 +662,10 @@ class StoreName(InstructionABC):
     def execute_decompiler(self) -> str: raise NotImplementedError
     def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.names[arg] = frame.stack.pop()
+
 
 class LoadName(InstructionABC):
     NAME = 'LOAD_NAME'
@@ -299,6 +676,10 @@ class LoadName(InstructionABC):
     def execute_decompiler(self) -> str: raise NotImplementedError
     def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.stack.append(frame.names[arg])
+
 
 class LoadGlobal(InstructionABC):
     NAME = 'LOAD_GLOBAL'
@@ -316,6 +697,27 @@ class LoadGlobal(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return GlobalCache(instr.argval)
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        namespace = frame.globals
+        if arg.version == namespace.version and (arg.scope < 2 or len(namespace.module) == arg.size):
+            value = namespace.scopes[arg.scope].get(arg.name, UNBOUND)
+            if value is not UNBOUND:
+                frame.stack.append(value)
+                return
+        arg.misses += 1
+        arg.scope, value = namespace.lookup(arg.name)
+        if value is UNBOUND:
+            arg.version = None
+            raise NameError(f'Name {arg.name} is not defined')
+        arg.version = namespace.version
+        arg.size = len(namespace.module)
+        frame.stack.append(value)
+
 
 class LoadMethod(InstructionABC):
     NAME = 'LOAD_METHOD'
@@ -331,6 +733,22 @@ class LoadMethod(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return MethodCache(instr.argval)
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        receiver = stack[-1]
+        if type(receiver) is arg.type:
+            stack[-1] = arg.bind(receiver)
+            return
+        arg.misses += 1
+        stack[-1] = getattr(receiver, arg.name)
+        arg.bind = method_binder(type(receiver), arg.name)
+        arg.type = UNBOUND if arg.bind is None else type(receiver)
+
 
 class Call(InstructionABC):
     NAME = 'CALL'
@@ -352,6 +770,122 @@ class Call(InstructionABC):
         self.stack.append(f'{func}({", ".join(map(str, args))})')
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        # arguments are removed only after the call returns, so a call which raised can be dispatched again,
+        # see virtual_machine.emulate_async
+        stack = frame.stack
+        if arg:
+            result = stack[-arg - 1](*stack[len(stack) - arg:])
+            del stack[len(stack) - arg:]
+            stack[-1] = result
+        else:
+            stack[-1] = stack[-1]()
+
+
+class MakeFunction(InstructionABC):
+    """
+    Functions made on VM are emulated as well, see virtual_machine.Function
+    """
+    NAME = 'MAKE_FUNCTION'
+
+    def execute_vm(self): raise NotImplementedError('Functions are supported only by the decoded VM')
+    def execute_decompiler(self) -> str: raise NotImplementedError('Nested functions are not supported')
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError('Nested functions are not supported')
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        code = stack.pop()
+        closure = stack.pop() if arg & 0x08 else ()
+        if arg & 0x04:
+            stack.pop()  # annotations
+        if arg & 0x02:
+            raise NotImplementedError('Keyword-only defaults are not supported')
+        defaults = stack.pop() if arg & 0x01 else ()
+        stack.append(frame.make_function(code, defaults, closure))
+
+
+class MakeCell(InstructionABC):
+    NAME = 'MAKE_CELL'
+
+    def execute_vm(self): raise NotImplementedError('Closures are supported only by the decoded VM')
+    def execute_decompiler(self) -> str: raise NotImplementedError('Closures are not supported')
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError('Closures are not supported')
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals, cells share them with the arguments
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        value = frame.locals[arg]
+        frame.locals[arg] = CellType() if value is UNBOUND else CellType(value)
+
+
+class CopyFreeVars(InstructionABC):
+    NAME = 'COPY_FREE_VARS'
+
+    def execute_vm(self): raise NotImplementedError
+    def execute_decompiler(self) -> str: raise NotImplementedError
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        # free variables are the last fast locals
+        frame.locals[len(frame.locals) - arg:] = frame.closure
+
+
+class LoadClosure(InstructionABC):
+    NAME = 'LOAD_CLOSURE'
+
+    def execute_vm(self): raise NotImplementedError
+    def execute_decompiler(self) -> str: raise NotImplementedError
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.stack.append(frame.locals[arg])
+
+
+class StoreDeref(InstructionABC):
+    NAME = 'STORE_DEREF'
+
+    def execute_vm(self): raise NotImplementedError
+    def execute_decompiler(self) -> str: raise NotImplementedError
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.locals[arg].cell_contents = frame.stack.pop()
+
+
+class LoadDeref(InstructionABC):
+    NAME = 'LOAD_DEREF'
+
+    def execute_vm(self): raise NotImplementedError
+    def execute_decompiler(self) -> str: raise NotImplementedError
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return instr.arg  # index in the fast locals
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        try:
+            frame.stack.append(frame.locals[arg].cell_contents)
+        except ValueError:
+            raise NameError(f'Free variable {frame.varnames[arg]} referenced before assignment') from None
+
 
 class GetIter(InstructionABC):
     NAME = 'GET_ITER'
@@ -367,6 +901,11 @@ class GetIter(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        stack[-1] = iter(stack[-1])
+
 
 class ForIter(InstructionABC):
     NAME = 'FOR_ITER'
@@ -394,14 +933,45 @@ class ForIter(InstructionABC):
     def execute_decompiler(self) -> str:
         next_instr = self.next_instrs[self.index]
         self.index += 1
-        self.indents.append(self.instr.argval)
+        heapq.heappush(self.indents, self.instr.argval)
         return f'for {self.get_iter_name(next_instr)} in {self.stack.pop()}:'
 
     def execute_onelinerizer(self) -> tuple[str, str]:
         next_instr = self.next_instrs[self.index]
         self.index += 1
-        self.indents.append(self.instr.argval)
-        return f'[[', f'][-1] for {self.get_iter_name(next_instr)} in {self.stack.pop()}][-1]'
+        # any() consumes the generator without keeping the results of iterations,
+        # body list is never empty so `not [...]` is always False and any() never stops early
+        self.indents.append(
+            Indent(self.instr.argval, f'] for {self.get_iter_name(next_instr)} in {self.stack.pop()}), ', loop=True)
+        )
+        return 'any(not [', ''
+
+    def execute_onelinerizer_walrus(self) -> tuple[str, str]:
+        # iteration variables of a comprehension are local to it and can't be rebound with :=,
+        # so the loop iterates under fresh names and binds the variables with := at the start of the body,
+        # they are assigned in the body and stay bound after the loop like in the original code
+        next_instr = self.next_instrs[self.index]
+        self.index += 1
+        names = self.get_iter_name(next_instr).split(', ')
+        targets = [fresh_name(name, self.next_instrs) for name in names]
+        bindings = ''.join(f'({name} := {target}), ' for name, target in zip(names, targets))
+        self.indents.append(
+            Indent(self.instr.argval, f'] for {", ".join(targets)} in {self.stack.pop()}), ', loop=True)
+        )
+        return 'any(not [' + bindings, ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return targets[instr.argval]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        try:
+            stack.append(next(stack[-1]))
+        except StopIteration:
+            stack.pop()
+            frame.index = arg
 
 
 class JumpBackward(InstructionABC):
@@ -410,8 +980,37 @@ class JumpBackward(InstructionABC):
     def execute_vm(self):
         self.index = self.instr.argval // 2
 
-    def execute_decompiler(self) -> str: return ''
-    def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+    def execute_decompiler(self) -> str:
+        # a jump to the loop start followed by an else ends an if block, it's a continue
+        # (the else region may end before the loop does, then the code after it has to be skipped)
+        if self.index < len(self.next_instrs) and self.next_instrs[self.index].opname == 'SUP_ELSE':
+            return 'continue'
+        return ''
+
+    def execute_onelinerizer(self) -> tuple[str, str]:
+        # jump to the loop start at the end of an if block, the rest of the loop body is the else branch
+        # (that's how both `continue` and if-else as the last statement of a loop are compiled)
+        next_offset = self.next_instrs[self.index].offset
+        loop = next((indent for indent in reversed(self.indents) if indent.loop), None)
+        start = start_else(self.indents, next_offset, loop.line_to if loop else math.inf)
+        if not start or loop is None:
+            return start, ''
+
+        nested = self.indents[self.indents.index(loop) + 1:-1]  # blocks between the loop and the new else
+        if not nested:
+            return start, ''
+        flag = continue_flag(loop, self.next_instrs)
+        for block in nested:
+            block.guard = flag
+        return f'{flag}.append(None), ' + start, ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return targets[instr.argval]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.index = arg
 
 
 class JumpForward(InstructionABC):
@@ -421,7 +1020,18 @@ class JumpForward(InstructionABC):
         self.index = self.instr.argval // 2
 
     def execute_decompiler(self) -> str: return ''
-    def execute_onelinerizer(self) -> tuple[str, str]: return '', ''
+
+    def execute_onelinerizer(self) -> tuple[str, str]:
+        next_offset = self.next_instrs[self.index].offset
+        return start_else(self.indents, next_offset, self.instr.argval), ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return targets[instr.argval]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        frame.index = arg
 
 
 class SupElse(InstructionABC):
@@ -434,12 +1044,11 @@ class SupElse(InstructionABC):
         raise NotImplementedError
 
     def execute_decompiler(self) -> str:
-        self.indents.append(self.instr.argval)
+        heapq.heappush(self.indents, self.instr.argval)
         return 'else:'
 
     def execute_onelinerizer(self) -> tuple[str, str]:
         raise NotImplementedError
-        # return '][-1]), False: (lambda: [', ''
 
 
 class BinaryOp(InstructionABC):
@@ -454,19 +1063,11 @@ class BinaryOp(InstructionABC):
         self.s = self.stack.pop()  # for some reason operands are reversed
         self.f = self.stack.pop()
 
-        if self.instr.argrepr.replace('=', '') not in ('+', '-', '*', '/', '%', '//'):
+        if self.instr.argrepr.replace('=', '') not in BINARY_OPS:
             raise ValueError(f'Unknown binary operation: {self.instr.argrepr}')
 
     def execute_vm(self):
-        mmap = {
-            '+': self.f + self.s,
-            '-': self.f - self.s,
-            '*': self.f * self.s,
-            '/': self.f / self.s,
-            '%': self.f % self.s,
-            '//': self.f // self.s
-        }
-        self.stack.append(mmap[self.instr.argrepr.replace('=', '')])
+        self.stack.append(BINARY_OPS[self.instr.argrepr.replace('=', '')](self.f, self.s))
 
     def execute_decompiler(self) -> str:
         self.stack.append(f'({self.f} {self.instr.argrepr.replace("=", "")} {self.s})')
@@ -476,6 +1077,18 @@ class BinaryOp(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        if instr.argrepr.replace('=', '') not in BINARY_OPS:
+            raise ValueError(f'Unknown binary operation: {instr.argrepr}')
+        return BINARY_OPS[instr.argrepr.replace('=', '')]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        s = stack.pop()
+        stack[-1] = arg(stack[-1], s)
+
 
 class CompareOp(InstructionABC):
     NAME = 'COMPARE_OP'
@@ -486,19 +1099,11 @@ class CompareOp(InstructionABC):
         self.s = self.stack.pop()  # for some reason operands are reversed
         self.f = self.stack.pop()
 
-        if self.instr.argrepr not in ('==', '!=', '<', '>', '<=', '>='):
+        if self.instr.argrepr not in COMPARE_OPS:
             raise ValueError(f'Unknown compare operation: {self.instr.argrepr}')
 
     def execute_vm(self):
-        mmap = {
-            '==': self.f == self.s,
-            '!=': self.f != self.s,
-            '<': self.f < self.s,
-            '>': self.f > self.s,
-            '<=': self.f <= self.s,
-            '>=': self.f >= self.s
-        }
-        self.stack.append(mmap[self.instr.argrepr])
+        self.stack.append(COMPARE_OPS[self.instr.argrepr](self.f, self.s))
 
     def execute_decompiler(self) -> str:
         self.stack.append(f'{self.f} {self.instr.argrepr} {self.s}')
@@ -508,6 +1113,18 @@ class CompareOp(InstructionABC):
         self.execute_decompiler()
         return '', ''
 
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        if instr.argrepr not in COMPARE_OPS:
+            raise ValueError(f'Unknown compare operation: {instr.argrepr}')
+        return COMPARE_OPS[instr.argrepr]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        stack = frame.stack
+        s = stack.pop()
+        stack[-1] = arg(stack[-1], s)
+
 
 class PopJumpForwardIfFalse(InstructionABC):
     NAME = 'POP_JUMP_FORWARD_IF_FALSE'
@@ -517,14 +1134,24 @@ class PopJumpForwardIfFalse(InstructionABC):
             self.index = self.instr.argval // 2
 
     def execute_decompiler(self) -> str:
-        self.indents.append(self.instr.argval)
+        heapq.heappush(self.indents, self.instr.argval)
         return f'if {self.stack.pop()}:'
 
     def execute_onelinerizer(self) -> tuple[str, str]:
-        return (
-            '{True: (lambda: [',
-            f'][-1])}}.get({self.stack.pop()}, lambda: None)()'
+        cond = self.stack.pop()
+        self.indents.append(
+            Indent(self.instr.argval, f'][-1] if {cond} else None), ', f'][-1] if {cond} else [')
         )
+        return '([', ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return targets[instr.argval]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        if not frame.stack.pop():
+            frame.index = arg
 
 
 class PopJumpForwardIfTrue(InstructionABC):
@@ -535,22 +1162,103 @@ class PopJumpForwardIfTrue(InstructionABC):
             self.index = self.instr.argval // 2
 
     def execute_decompiler(self) -> str:
-        self.indents.append(self.instr.argval)
+        heapq.heappush(self.indents, self.instr.argval)
         return f'if not {self.stack.pop()}:'
 
     def execute_onelinerizer(self) -> tuple[str, str]:
+        cond = self.stack.pop()
+        self.indents.append(
+            Indent(self.instr.argval, f'][-1] if not {cond} else None), ', f'][-1] if not {cond} else [')
+        )
+        return '([', ''
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        return targets[instr.argval]
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        if frame.stack.pop():
+            frame.index = arg
+
+
+class Superinstruction(InstructionABC):
+    """
+    Pair of instructions fused by the peephole pass of the VM, so the pair pays the dispatch only once.
+    It exists only in the decoded program, argval of its instruction is the pair of fused instructions
+    """
+    def execute_vm(self): raise NotImplementedError
+    def execute_decompiler(self) -> str: raise NotImplementedError
+    def execute_onelinerizer(self) -> tuple[str, str]: raise NotImplementedError
+
+    @classmethod
+    def decode_arg(cls, instr: Instruction, targets: dict[int, int]):
+        first, second = instr.argval
         return (
-            '{True: (lambda: [',
-            f'][-1])}}.get(not {self.stack.pop()}, lambda: None)()'
+            opcodes_map[first.opname].decode_arg(first, targets),
+            opcodes_map[second.opname].decode_arg(second, targets)
         )
 
 
+class LoadFastLoadFast(Superinstruction):
+    NAME = 'LOAD_FAST__LOAD_FAST'
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        first, second = arg
+        a = frame.locals[first]
+        b = frame.locals[second]
+        if a is UNBOUND or b is UNBOUND:
+            raise UnboundLocalError(f'Variable {frame.varnames[first if a is UNBOUND else second]} not defined')
+        stack = frame.stack
+        stack.append(a)
+        stack.append(b)
+
+
+class LoadConstBinaryOp(Superinstruction):
+    NAME = 'LOAD_CONST__BINARY_OP'
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        const, op = arg
+        stack = frame.stack
+        stack[-1] = op(stack[-1], const)
+
+
+class CompareOpPopJumpForwardIfFalse(Superinstruction):
+    NAME = 'COMPARE_OP__POP_JUMP_FORWARD_IF_FALSE'
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        op, target = arg
+        stack = frame.stack
+        s = stack.pop()
+        if not op(stack.pop(), s):
+            frame.index = target
+
+
+class ForIterStoreFast(Superinstruction):
+    NAME = 'FOR_ITER__STORE_FAST'
+
+    @staticmethod
+    def vm_handler(frame, arg):
+        target, local = arg
+        stack = frame.stack
+        try:
+            frame.locals[local] = next(stack[-1])
+        except StopIteration:
+            stack.pop()
+            frame.index = target
+
+
 opcodes_map: dict[str: InstructionABC] = {
     'RESUME': Resume,
     'RETURN_VALUE': Return,
     'NOP': Nop,
     'POP_TOP': PopTop,
     'PRECALL': Precall,
+    'EXTENDED_ARG': ExtendedArg,
+    'PUSH_NULL': PushNull,
     'BUILD_LIST': BuildList,
     'BUILD_TUPLE': BuildTuple,
     'BUILD_CONST_KEY_MAP': BuildConstKeyMap,
@@ -566,13 +1274,33 @@ opcodes_map: dict[str: InstructionABC] = {
     'LOAD_GLOBAL': LoadGlobal,
     'LOAD_METHOD': LoadMethod,
     'CALL': Call,
+    'MAKE_FUNCTION': MakeFunction,
+    'MAKE_CELL': MakeCell,
+    'COPY_FREE_VARS': CopyFreeVars,
+    'LOAD_CLOSURE': LoadClosure,
+    'STORE_DEREF': StoreDeref,
+    'LOAD_DEREF': LoadDeref,
     'GET_ITER': GetIter,
     'FOR_ITER': ForIter,
     'JUMP_BACKWARD': JumpBackward,
     'JUMP_FORWARD': JumpForward,
     'SUP_ELSE': SupElse,
+    'STORE_TEMP': StoreTemp,
+    'LOAD_TEMP': LoadTemp,
     'BINARY_OP': BinaryOp,
     'COMPARE_OP': CompareOp,
     'POP_JUMP_FORWARD_IF_FALSE': PopJumpForwardIfFalse,
-    'POP_JUMP_FORWARD_IF_TRUE': PopJumpForwardIfTrue
+    'POP_JUMP_FORWARD_IF_TRUE': PopJumpForwardIfTrue,
+    'LOAD_FAST__LOAD_FAST': LoadFastLoadFast,
+    'LOAD_CONST__BINARY_OP': LoadConstBinaryOp,
+    'COMPARE_OP__POP_JUMP_FORWARD_IF_FALSE': CompareOpPopJumpForwardIfFalse,
+    'FOR_ITER__STORE_FAST': ForIterStoreFast
+}
+
+# pairs of opnames which the VM can fuse into one instruction
+superinstructions_map: dict[tuple[str, str], Superinstruction] = {
+    ('LOAD_FAST', 'LOAD_FAST'): LoadFastLoadFast,
+    ('LOAD_CONST', 'BINARY_OP'): LoadConstBinaryOp,
+    ('COMPARE_OP', 'POP_JUMP_FORWARD_IF_FALSE'): CompareOpPopJumpForwardIfFalse,
+    ('FOR_ITER', 'STORE_FAST'): ForIterStoreFast
 }
\ No newline at end of file
@@ -0,0 +1,13 @@
+def main():
+    def fib(n):
+        if n < 2:
+            return n
+        return fib(n - 1) + fib(n - 2)
+
+    print(fib(20))
+
+    return
+
+
+if __name__ == '__main__':
+    main()
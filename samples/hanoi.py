@@ -0,0 +1,20 @@
+def main():
+    def hanoi(n, source, target, spare):
+        if n == 0:
+            return 0
+        moves = hanoi(n - 1, source, spare, target)
+        return moves + 1 + hanoi(n - 1, spare, target, source)
+
+    def factorial(n, result=1):
+        if n < 2:
+            return result
+        return factorial(n - 1, result * n)
+
+    print(hanoi(14, 'a', 'c', 'b'))
+    print(factorial(150) % 1000000007)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
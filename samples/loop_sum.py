@@ -0,0 +1,12 @@
+def main():
+    total = 0
+    for i in range(100000):
+        if i % 3 == 0:
+            total += i
+    print(total)
+
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+"""
+Local emulation server. Jobs with source are compiled and run by virtual_machine.emulate in a pool of worker
+processes started once with the server, so a job doesn't pay for starting an interpreter.
+Every job has an instruction budget, a timeout and an address space limit, capped by the limits of the server,
+printed output is streamed back while the job runs.
+This is resource limiting, not a sandbox: jobs see the real builtins and can open files, import modules and
+start processes as the user of the server, only run code you trust or the server in an isolated environment
+
+Usage:
+    python server.py serve [--port 8765 | --unix PATH] [--workers N] [--max-instructions N] [--timeout S] [--memory MiB]
+    python server.py run PROGRAM.py [--function main] [--stdin FILE] [--max-instructions N] [--timeout S] [--memory MiB]
+    python server.py metrics
+
+The protocol is JSON lines over loopback TCP or a Unix socket. A client sends one job:
+    {"source": "...", "function": "main", "stdin": "", "max_instructions": 1000000, "timeout": 1.0, "memory": 64}
+and gets back {"output": "..."} lines followed by
+    {"done": true, "error": null, "seconds": ..., "queued": ..., "latency": ...}.
+{"metrics": true} gets {"metrics": {...}} with the queue depth, latency percentiles and throughput
+"""
+import argparse
+import asyncio
+import collections
+import io
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from pathlib import Path
+from typing import Iterator
+
+try:
+    import resource
+except ImportError:  # not on Windows, jobs run without the memory limit there
+    resource = None
+
+PORT = 8765
+RESTART_DELAY = 1.0  # seconds before starting a worker again after it failed to start, doubled up to a minute
+WINDOW = 60.0  # seconds of finished jobs the throughput is computed over
+
+
+class Output(io.TextIOBase):
+    """
+    stdout of a job in a worker, printed text is sent to the server every batch of instructions
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.parts: list[str] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self.parts.append(text)
+        return len(text)
+
+    def flush(self):
+        if self.parts:
+            self.conn.send({'output': ''.join(self.parts)})
+            self.parts.clear()
+
+
+def address_space() -> int:
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def limit_memory(limit: int | None):
+    """
+    Lets the worker allocate at most limit more bytes of address space, allocations over it raise MemoryError
+    :return: function which removes the limit
+    """
+    if limit is None or resource is None or not os.path.exists('/proc/self/statm'):
+        return lambda: None
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    wanted = address_space() + limit
+    resource.setrlimit(resource.RLIMIT_AS, (wanted if hard == resource.RLIM_INFINITY else min(wanted, hard), hard))
+    return lambda: resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def load_code(job: dict):
+    from batch import find_functions
+
+    functions = list(find_functions(compile(job['source'], '<job>', 'exec'), job.get('function', 'main')))
+    if not functions:
+        raise ValueError(f'{job.get("function", "main")} is not defined')
+    return functions[0]
+
+
+def run_job(job: dict, conn):
+    import virtual_machine
+
+    output = Output(conn)
+    old_stdin, old_stdout = sys.stdin, sys.stdout
+    sys.stdin, sys.stdout = io.StringIO(job.get('stdin', '')), output
+    error = None
+    start = time.perf_counter()
+    unlimit = limit_memory(job.get('memory'))
+    try:
+        virtual_machine.emulate(load_code(job), max_instructions=job.get('max_instructions'),
+                                timeout=job.get('timeout'), on_batch=lambda frame, executed: output.flush(),
+                                fuse=job.get('fuse', False))
+    except BaseException as e:
+        error = f'{type(e).__name__}: {e}'
+    finally:
+        unlimit()
+        sys.stdin, sys.stdout = old_stdin, old_stdout
+    output.flush()
+    conn.send({'done': True, 'error': error, 'seconds': time.perf_counter() - start})
+
+
+def worker(conn):
+    """
+    Main function of a worker process, runs jobs until it gets None
+    """
+    import virtual_machine
+
+    virtual_machine.emulate(compile('def main(): return', '<warm-up>', 'exec').co_consts[0])
+    conn.send({'ready': True})
+    while (job := conn.recv()) is not None:
+        run_job(job, conn)
+
+
+class Worker:
+    def __init__(self, context):
+        self.context = context
+        self.process = None
+        self.conn = None
+
+    async def start(self):
+        self.conn, child = self.context.Pipe()
+        self.process = self.context.Process(target=worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        await self.receive()
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.kill()
+        if self.process.pid is not None:  # a process which failed to start can't be joined
+            self.process.join()
+        self.conn.close()
+
+    async def receive(self) -> dict:
+        """
+        Waits for a message without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        while not self.conn.poll():
+            readable = asyncio.Event()
+            loop.add_reader(self.conn.fileno(), readable.set)
+            try:
+                await readable.wait()
+            finally:
+                loop.remove_reader(self.conn.fileno())
+        return self.conn.recv()
+
+
+def percentile(values, q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    def __init__(self, history: int = 1000):
+        """
+        :param history: number of the last jobs the percentiles are computed over
+        """
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.latencies = collections.deque(maxlen=history)  # from accepting a job to its last message
+        self.waits = collections.deque(maxlen=history)  # time in the queue
+        self.finished = collections.deque()  # finish times within WINDOW
+
+    def record(self, report: dict):
+        self.completed += 1
+        self.failed += report['error'] is not None
+        self.latencies.append(report['latency'])
+        self.waits.append(report['queued'])
+        now = time.monotonic()
+        self.finished.append(now)
+        while self.finished and self.finished[0] < now - WINDOW:
+            self.finished.popleft()
+
+    def snapshot(self, queued: int, busy: int, workers: int) -> dict:
+        now = time.monotonic()
+        while self.finished and self.finished[0] < now - WINDOW:
+            self.finished.popleft()
+        window = min(WINDOW, now - self.started)
+        return {
+            'queue_depth': queued, 'busy_workers': busy, 'workers': workers,
+            'completed': self.completed, 'failed': self.failed,
+            'throughput': len(self.finished) / window if window else 0.0,  # jobs per second over the window
+            'latency': {f'p{q}': percentile(self.latencies, q / 100) for q in (50, 90, 99)},
+            'queued': {f'p{q}': percentile(self.waits, q / 100) for q in (50, 90, 99)},
+        }
+
+
+class EmulationServer:
+    def __init__(self, workers: int = None, max_instructions: int = 10 ** 7, timeout: float = 10.0,
+                 memory: int = 256):
+        """
+        :param workers: number of worker processes, all cores by default
+        :param max_instructions: the most instructions a job may ask for, also the default
+        :param timeout: the most seconds a job may ask for, also the default
+        :param memory: the most MiB of address space a job may ask for, also the default
+        """
+        self.context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(self.context) for _ in range(workers or os.cpu_count() or 1)]
+        self.limits = {'max_instructions': max_instructions, 'timeout': timeout, 'memory': memory}
+        self.jobs: asyncio.Queue = None
+        self.busy = 0
+        self.metrics = Metrics()
+        self.tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        self.jobs = asyncio.Queue()
+        await asyncio.gather(*(worker.start() for worker in self.workers))
+        self.tasks = [asyncio.create_task(self.serve_jobs(worker)) for worker in self.workers]
+
+    def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        for worker in self.workers:
+            worker.stop()
+
+    def job_limits(self, job: dict) -> dict:
+        """
+        Limits asked by the job, never above the limits of the server
+        """
+        limited = {}
+        for name, cap in self.limits.items():
+            asked = job.get(name)
+            limited[name] = cap if asked is None else min(asked, cap)
+        limited['memory'] *= 1024 * 1024
+        return limited
+
+    async def restart(self, worker: Worker):
+        """
+        Replaces the process of the worker, a process which fails to start is logged and started again
+        after a growing delay, so the pool doesn't lose the worker
+        """
+        delay = RESTART_DELAY
+        while True:
+            worker.stop()
+            try:
+                await worker.start()
+                return
+            except (EOFError, OSError) as e:
+                print(f'worker failed to start: {type(e).__name__}: {e}, retrying in {delay:g}s', file=sys.stderr)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    async def serve_jobs(self, worker: Worker):
+        while True:
+            job, messages, accepted = await self.jobs.get()
+            self.busy += 1
+            queued = time.monotonic() - accepted
+            try:
+                worker.conn.send(job)
+                # the job stops itself on timeout, this is for native code which doesn't give control back
+                async with asyncio.timeout(job['timeout'] * 2 + 5):
+                    while not (message := await worker.receive()).get('done'):
+                        messages.put_nowait(message)
+            except (EOFError, OSError, TimeoutError) as e:
+                message = {'done': True, 'error': f'worker was restarted: {type(e).__name__}: {e}', 'seconds': None}
+                await self.restart(worker)
+            finally:
+                self.busy -= 1
+
+            message.update(queued=queued, latency=time.monotonic() - accepted)
+            self.metrics.record(message)
+            messages.put_nowait(message)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            if not isinstance(request, dict):
+                raise TypeError(f'a request is a JSON object, not {type(request).__name__}')
+            if request.get('metrics'):
+                snapshot = self.metrics.snapshot(self.jobs.qsize(), self.busy, len(self.workers))
+                writer.write(json.dumps({'metrics': snapshot}).encode() + b'\n')
+                return
+
+            if not isinstance(request.get('source'), str):
+                raise TypeError('a job needs its source as a string')
+            job = {key: value for key, value in request.items() if key in ('source', 'function', 'stdin', 'fuse')}
+            job.update(self.job_limits(request))
+            messages = asyncio.Queue()
+            self.jobs.put_nowait((job, messages, time.monotonic()))
+            while True:
+                message = await messages.get()
+                writer.write(json.dumps(message).encode() + b'\n')
+                await writer.drain()
+                if message.get('done'):
+                    break
+        except (ValueError, TypeError) as e:  # not a JSON object or wrong types of the limits
+            writer.write(json.dumps({'done': True, 'error': f'{type(e).__name__}: {e}'}).encode() + b'\n')
+        except ConnectionError:
+            pass  # the client is gone, the job still runs to the end
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = PORT, path: str = None):
+        await self.start()
+        try:
+            if path is not None:
+                server = await asyncio.start_unix_server(self.handle, path)
+            else:
+                server = await asyncio.start_server(self.handle, host, port)
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.stop()
+
+
+def connect(host: str = '127.0.0.1', port: int = PORT, path: str = None) -> socket.socket:
+    if path is not None:
+        client = socket.socket(socket.AF_UNIX)
+        client.connect(path)
+        return client
+    return socket.create_connection((host, port))
+
+
+def submit(request: dict, host: str = '127.0.0.1', port: int = PORT, path: str = None) -> Iterator[dict]:
+    """
+    Sends a job or a metrics request and yields the messages of the server as they come
+    """
+    with connect(host, port, path) as client, client.makefile('rwb') as stream:
+        stream.write(json.dumps(request).encode() + b'\n')
+        stream.flush()
+        for line in stream:
+            yield json.loads(line)
+
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description='Emulation server with a pool of worker processes')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--unix', help='Unix socket path instead of TCP')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='start the server')
+    serve.add_argument('--workers', type=int, default=None, help='number of processes, all cores by default')
+    run = commands.add_parser('run', help='run a program on the server and print its output')
+    run.add_argument('program', type=Path)
+    run.add_argument('--function', default='main', help='name of the function to emulate')
+    run.add_argument('--stdin', type=Path, help='input of the program')
+    run.add_argument('--fuse', action='store_true', help='emulate with superinstructions')
+    for command, default in ((serve, ' the server allows'), (run, ' for the job')):
+        command.add_argument('--max-instructions', type=int, help=f'the most instructions{default}')
+        command.add_argument('--timeout', type=float, help=f'the most seconds{default}')
+        command.add_argument('--memory', type=int, help=f'the most MiB of address space{default}')
+    commands.add_parser('metrics', help='print metrics of the server')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        limits = {name: getattr(args, name) for name in ('max_instructions', 'timeout', 'memory')
+                  if getattr(args, name) is not None}
+        try:
+            asyncio.run(EmulationServer(args.workers, **limits).serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.command == 'metrics':
+        request = {'metrics': True}
+    else:
+        request = {'source': args.program.read_text(), 'function': args.function,
+                   'stdin': args.stdin.read_text() if args.stdin else '', 'fuse': args.fuse,
+                   'max_instructions': args.max_instructions, 'timeout': args.timeout, 'memory': args.memory}
+    for message in submit(request, args.host, args.port, args.unix):
+        if 'metrics' in message:
+            print(json.dumps(message['metrics'], indent=2))
+        elif 'output' in message:
+            print(message['output'], end='', flush=True)
+        elif message['error']:
+            print(message['error'], file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,654 @@
 Virtual machine for Python bytecode
 """
 
+import asyncio
+import builtins
 import dis
-from opcodes import opcodes_map
+import functools
+import inspect
+import itertools
+import json
+import sys
+import time
+from dataclasses import dataclass, field
+from types import CodeType
+from ir import JUMPS, get_ir
+from opcodes import UNBOUND, InlineCache, opcodes_map, superinstructions_map
 
+_versions = itertools.count(1)
+FIRST_BATCH = 64  # size of the first batch of run_limited
 
-def emulate(bytecode: dis.Bytecode):
+
+class Namespace(dict):
+    """
+    Globals of emulated code. The dict itself holds names set for the emulation, like print of emulate_async,
+    they shadow the module globals, which shadow builtins. Module globals and builtins aren't copied, they are
+    read live, so changes made from outside while the code runs are seen. Every change of the dict itself gives it
+    a new version, unique among all namespaces, inline caches of LOAD_GLOBAL check it and watch the live dicts
+    themselves, see opcodes.GlobalCache
+    """
+    __slots__ = ('version', 'module', 'scopes')
+
+    def __init__(self, module: dict = None):
+        """
+        :param module: globals of the module of the emulated code, only builtins by default
+        """
+        super().__init__()
+        self.version = next(_versions)
+        self.module = {} if module is None else module
+        self.scopes = (self, self.module, builtins.__dict__)
+
+    @classmethod
+    def of(cls, source) -> 'Namespace':
+        """
+        :param source: function or dis.Bytecode of one to take the globals from, anything else gets only builtins
+        """
+        source = getattr(source, '_original_object', source)  # what dis.Bytecode was made from
+        return cls(getattr(source, '__globals__', None))
+
+    def lookup(self, name: str) -> tuple[int, object]:
+        """
+        :return: index of the scope the name is found in and its value, UNBOUND value if it isn't defined
+        """
+        for index, scope in enumerate(self.scopes):
+            value = scope.get(name, UNBOUND)
+            if value is not UNBOUND:
+                return index, value
+        return len(self.scopes), UNBOUND
+
+    def _changed(self):
+        self.version = next(_versions)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        value = super().setdefault(key, default)
+        self._changed()
+        return value
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+
+@dataclass(slots=True)
+class Frame:
+    """
+    State shared by all handlers of the decoded loop, handlers themselves don't keep any state.
+    Fast locals are a list indexed by the LOAD_FAST/STORE_FAST argument, cells and free variables
+    come after the variables just like in CPython. names are for STORE_NAME/LOAD_NAME
+    """
+    varnames: tuple = ()
+    locals: list = field(default_factory=list)
+    stack: list = field(default_factory=list)
+    names: dict = field(default_factory=dict)
+    index: int = 0
+    globals: Namespace = None  # set by Frame.new and Function
+    closure: tuple = ()  # cells of the free variables, copied to the locals by COPY_FREE_VARS
+    retval: object = None  # set by RETURN_VALUE
+    runner: object = None  # runs functions made in the frame, see Function
+    fuse: bool = False  # functions made in the frame are decoded with superinstructions
+
+    @classmethod
+    def new(cls, bytecode: dis.Bytecode) -> 'Frame':
+        """
+        :param bytecode: bytecode from dis, function or code object
+        """
+        varnames = local_names(get_ir(bytecode).code)
+        return cls(varnames, [UNBOUND] * len(varnames), globals=Namespace.of(bytecode))
+
+    def make_function(self, code: CodeType, defaults: tuple, closure: tuple) -> 'Function':
+        return Function(code, self.globals, defaults, closure, self.runner, self.fuse)
+
+    def variables(self) -> dict:
+        """
+        :return: bound fast locals by name
+        """
+        return {name: value for name, value in zip(self.varnames, self.locals) if value is not UNBOUND}
+
+
+def local_names(code: CodeType) -> tuple[str, ...]:
+    """
+    :return: names of all fast locals of the code: variables, cells which aren't arguments and free variables
+    """
+    cells = tuple(name for name in code.co_cellvars if name not in code.co_varnames)
+    return code.co_varnames + cells + code.co_freevars
+
+
+class FramePool:
+    """
+    Frames of one code object. A call takes a frame from the pool and gives it back after returning,
+    so calls don't allocate frames and their locals once the pool has as many frames as the deepest recursion
+    """
+
+    def __init__(self, code: CodeType):
+        self.varnames = local_names(code)
+        self.unbound = [UNBOUND] * len(self.varnames)
+        self.free: list[Frame] = []
+        self.created = 0
+
+    def acquire(self) -> Frame:
+        if self.free:
+            return self.free.pop()
+        self.created += 1
+        return Frame(self.varnames, self.unbound.copy())
+
+    def release(self, frame: Frame):
+        frame.locals[:] = self.unbound
+        frame.stack.clear()
+        frame.names.clear()
+        frame.index = 0
+        frame.globals = None
+        frame.closure = ()
+        frame.retval = None
+        frame.fuse = False
+        self.free.append(frame)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_code(code: CodeType, fuse: bool = False) -> tuple[list[tuple], list[dis.Instruction], FramePool]:
+    """
+    :return: decoded program, its instructions and the frame pool of a code object, made once per code object
+    """
+    return decode(code, fuse), vm_instructions(code, fuse)[0], FramePool(code)
+
+
+class Function:
+    """
+    Function made by MAKE_FUNCTION on VM. Calling it runs its code on VM in a frame from the pool of the code,
+    so it works both when called by the emulated program and when passed to native code like map or sorted.
+    Every call is a nested run of the loop, so the recursion depth is limited by the recursion limit of Python
+    """
+
+    def __init__(self, code: CodeType, globals: Namespace, defaults: tuple = (), closure: tuple = (),
+                 runner=None, fuse: bool = False):
+        """
+        :param globals: namespace of the frame which made the function
+        :param runner: called as runner(function, frame) to run the function, run is used if it's None
+        :param fuse: decode the code with superinstructions
+        """
+        if code.co_flags & (inspect.CO_VARARGS | inspect.CO_VARKEYWORDS) or code.co_kwonlyargcount:
+            raise NotImplementedError(f'Only positional arguments are supported, {code.co_name} has others')
+        self.code = code
+        self.globals = globals
+        self.defaults = defaults
+        self.closure = closure
+        self.runner = runner
+        self.fuse = fuse
+        self.program, self.instructions, self.pool = compile_code(code, fuse)
+        self.__name__ = code.co_name
+        self.__qualname__ = code.co_qualname
+
+    def __repr__(self):
+        return f'<emulated function {self.__qualname__}>'
+
+    def __call__(self, *args):
+        code = self.code
+        missing = code.co_argcount - len(args)
+        if missing < 0 or missing > len(self.defaults):
+            raise TypeError(f'{self.__qualname__}() takes {code.co_argcount} arguments but {len(args)} were given')
+        if missing:
+            args += self.defaults[len(self.defaults) - missing:]
+
+        frame = self.pool.acquire()
+        frame.locals[:code.co_argcount] = args
+        frame.globals = self.globals
+        frame.closure = self.closure
+        frame.runner = self.runner
+        frame.fuse = self.fuse
+        try:
+            if self.runner is None:
+                run(self.program, frame)
+            else:
+                self.runner(self, frame)
+            return frame.retval
+        finally:
+            self.pool.release(frame)
+
+
+class LimitExceeded(RuntimeError):
+    """
+    Raised when the emulated program runs out of its instruction budget or time
+    """
+
+    def __init__(self, reason: str, executed: int, offset: int | None, frame: Frame):
+        """
+        :param reason: 'instructions' or 'timeout'
+        :param executed: number of executed instructions
+        :param offset: offset of the instruction which would run next
+        :param frame: frame at the moment of stopping, locals are copied from it
+        """
+        super().__init__(f'{reason} limit exceeded after {executed} instructions at offset {offset}')
+        self.reason = reason
+        self.executed = executed
+        self.offset = offset
+        self.stack_depth = len(frame.stack)
+        self.locals = frame.variables()
+
+
+class Budget:
+    """
+    Instructions left for the emulated code and all calls of emulated functions it makes. Batches are counted
+    after they ran, nothing is reserved up front, so a call never waits for instructions its callers hold:
+    a program which needs at most the limit always finishes. A batch is never longer than what's left
+    when it starts, but calls made inside it count too, so the program is stopped at most one batch
+    of every frame running at that moment past the limit, and executed always is the exact count
+    """
+    __slots__ = ('left', 'executed')
+
+    def __init__(self, max_instructions: int = None):
+        """
+        :param max_instructions: None for no limit
+        """
+        self.left = max_instructions
+        self.executed = 0
+
+    def take(self, steps: int, frame: Frame, instructions: list[dis.Instruction]) -> int:
+        """
+        :return: number of instructions the batch may execute
+        """
+        if self.left is None:
+            return steps
+        if self.left <= 0:
+            raise LimitExceeded('instructions', self.executed, instructions[frame.index].offset, frame)
+        return min(steps, self.left)
+
+    def spend(self, done: int):
+        """
+        :param done: number of instructions the batch executed
+        """
+        self.executed += done
+        if self.left is not None:
+            self.left -= done
+
+
+class Profile:
+    """
+    Execution count and cumulative time of every instruction of the program
+    and hit rates of the inline caches
+    """
+
+    def __init__(self, instructions: list[dis.Instruction], program: list[tuple] = None):
+        """
+        :param program: decoded program, needed only for the inline cache statistics
+        """
+        self.instructions = instructions
+        self.program = program or []
+        self.counts = [0] * len(instructions)
+        self.ns = [0] * len(instructions)
+
+    def by_offset(self) -> list[dict]:
+        rows = [
+            {'offset': instr.offset, 'opname': instr.opname, 'argrepr': instr.argrepr,
+             'count': count, 'seconds': ns / 1e9}
+            for instr, count, ns in zip(self.instructions, self.counts, self.ns) if count
+        ]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    def by_opname(self) -> list[dict]:
+        rows = {}
+        for instr, count, ns in zip(self.instructions, self.counts, self.ns):
+            row = rows.setdefault(instr.opname, {'opname': instr.opname, 'count': 0, 'seconds': 0.0})
+            row['count'] += count
+            row['seconds'] += ns / 1e9
+        return sorted((row for row in rows.values() if row['count']), key=lambda row: row['seconds'], reverse=True)
+
+    def by_cache(self) -> list[dict]:
+        rows = []
+        for instr, (handler, arg), count in zip(self.instructions, self.program, self.counts):
+            if isinstance(arg, InlineCache) and count:
+                rows.append({'offset': instr.offset, 'opname': instr.opname, 'name': arg.name, 'count': count,
+                             'misses': arg.misses, 'hit_rate': (count - arg.misses) / count})
+        return sorted(rows, key=lambda row: row['count'], reverse=True)
+
+    def table(self, by: str = 'opname') -> str:
+        """
+        :param by: 'opname', 'offset' or 'cache'
+        """
+        if by == 'cache':
+            lines = [f'{"offset":>6}  {"opname":<16}{"name":<20}{"count":>12}{"misses":>10}{"hit rate":>10}']
+            for row in self.by_cache():
+                lines.append(f'{row["offset"]:>6}  {row["opname"]:<16}{row["name"]:<20}{row["count"]:>12}'
+                             f'{row["misses"]:>10}{row["hit_rate"]:>10.1%}')
+            return '\n'.join(lines)
+
+        if by == 'opname':
+            lines = [f'{"opname":<40}{"count":>12}{"seconds":>12}{"ns/exec":>10}']
+            rows = self.by_opname()
+        else:
+            lines = [f'{"offset":>6}  {"opname":<40}{"count":>12}{"seconds":>12}{"ns/exec":>10}']
+            rows = self.by_offset()
+
+        for row in rows:
+            prefix = f'{row["opname"]:<40}' if by == 'opname' else f'{row["offset"]:>6}  {row["opname"]:<40}'
+            lines.append(f'{prefix}{row["count"]:>12}{row["seconds"]:>12.6f}{row["seconds"] / row["count"] * 1e9:>10.0f}')
+        return '\n'.join(lines)
+
+    def to_json(self) -> str:
+        return json.dumps({'opnames': self.by_opname(), 'offsets': self.by_offset(), 'caches': self.by_cache()},
+                          indent=2)
+
+
+def vm_instructions(bytecode: dis.Bytecode, fuse: bool = False) -> tuple[list[dis.Instruction], dict[int, int]]:
+    """
+    :param fuse: replace pairs of instructions with superinstructions, see fuse_instructions
+    :return: instructions which are executed on VM and map from offset to their index,
+        dropped instructions point to the next kept one
+    """
+    instructions = []
+    targets = {}
+    for instr in get_ir(bytecode).instructions:
+        if instr.opname not in opcodes_map:
+            raise ValueError(f'Unknown opname: {instr.opname}')
+
+        targets[instr.offset] = len(instructions)
+        if not opcodes_map[instr.opname].VM_NOOP:
+            instructions.append(instr)
+
+    if fuse:
+        return fuse_instructions(instructions, targets)
+    return instructions, targets
+
+
+def fuse_instructions(instructions: list[dis.Instruction],
+                      targets: dict[int, int]) -> tuple[list[dis.Instruction], dict[int, int]]:
+    """
+    Peephole pass which replaces pairs from superinstructions_map with one instruction named after the pair,
+    its argval is the pair and its offset is the offset of the first one. The second instruction of a pair
+    can't be a jump target, a jump would land in the middle of the superinstruction otherwise
+    :return: same as vm_instructions
+    """
+    jumped_to = {targets[instr.argval] for instr in instructions if instr.opname in JUMPS}
+    fused = []
+    moved = []  # old index -> new index
+    i = 0
+    while i < len(instructions):
+        instr = instructions[i]
+        moved.append(len(fused))
+        pair = instructions[i + 1] if i + 1 < len(instructions) and i + 1 not in jumped_to else None
+        superinstruction = superinstructions_map.get((instr.opname, pair.opname)) if pair else None
+        if superinstruction is None:
+            fused.append(instr)
+            i += 1
+            continue
+
+        fused.append(instr._replace(opname=superinstruction.NAME, argval=(instr, pair),
+                                    argrepr=f'{instr.argrepr}; {pair.argrepr}'))
+        moved.append(len(fused) - 1)
+        i += 2
+
+    moved.append(len(fused))  # targets past the last instruction
+    return fused, {offset: moved[index] for offset, index in targets.items()}
+
+
+def decode(bytecode: dis.Bytecode, fuse: bool = False) -> list[tuple]:
+    """
+    Turns every instruction into a pair of a stateless handler and its operand, so the loop
+    doesn't have to look anything up or create objects while running.
+    Jump targets are resolved to program indexes here, so there is no need to pad the gaps
+    left by inline caches, and instructions which do nothing on VM are dropped
+    :param bytecode: bytecode from dis, function or code object
+    :param fuse: replace common pairs of instructions with superinstructions
+    :return: list of (handler, arg) pairs
+    """
+    instructions, targets = vm_instructions(bytecode, fuse)
+    program = []
+    for instr in instructions:
+        opcode = opcodes_map[instr.opname]
+        program.append((opcode.vm_handler, opcode.decode_arg(instr, targets)))
+
+    return program
+
+
+def run(program: list[tuple], frame: Frame):
+    n = len(program)
+    while frame.index < n:
+        handler, arg = program[frame.index]
+        frame.index += 1
+        handler(frame, arg)
+
+
+def run_batch(program: list[tuple], frame: Frame, steps: int) -> int:
+    """
+    Same as run, but executes at most steps instructions
+    :return: number of executed instructions, less than steps only if the program ended.
+        A Suspend raised by an instruction gets the number of instructions executed before it
+    """
+    n = len(program)
+    step = 0
+    try:
+        for step in range(steps):
+            if frame.index >= n:
+                return step
+            handler, arg = program[frame.index]
+            frame.index += 1
+            handler(frame, arg)
+    except Suspend as e:
+        e.executed = step
+        raise
+    return steps
+
+
+def run_profiled(program: list[tuple], frame: Frame, profile: Profile, callback=None):
+    """
+    Same as run, but measures every instruction. It's a separate loop, so run doesn't pay anything for it
+    :param profile: Profile of the program to add counts and times to
+    :param callback: called as callback(instr, frame, ns) after every instruction
+    """
+    instructions = profile.instructions
+    clock = time.perf_counter_ns
+    n = len(program)
+    while frame.index < n:
+        i = frame.index
+        handler, arg = program[i]
+        frame.index += 1
+        start = clock()
+        handler(frame, arg)
+        ns = clock() - start
+        profile.counts[i] += 1
+        profile.ns[i] += ns
+        if callback is not None:
+            callback(instructions[i], frame, ns)
+
+
+def run_limited(program: list[tuple], frame: Frame, instructions: list[dis.Instruction],
+                max_instructions: int | Budget = None, deadline: float = None, batch: int = 4096,
+                on_batch=None) -> int:
+    """
+    Same as run, but stops the program once it executes max_instructions or runs past the deadline.
+    Limits are checked between batches of instructions, so the loop inside a batch stays as cheap as in run.
+    Batches start small and double up to batch, so the batches of short calls of emulated functions, which are
+    running while the limit is crossed, add little to how far past it the program goes
+    :param instructions: instructions of the program, to report where it stopped
+    :param max_instructions: limit or a Budget shared with the runs of the emulated functions the program calls
+    :param deadline: time.monotonic() after which the program is stopped
+    :param batch: the most instructions between the checks
+    :param on_batch: called as on_batch(frame, executed) after every batch, may raise to stop the program
+    :return: number of executed instructions
+    """
+    budget = max_instructions if isinstance(max_instructions, Budget) else Budget(max_instructions)
+    n = len(program)
+    executed = 0
+    size = min(batch, FIRST_BATCH)
+    while frame.index < n:
+        steps = budget.take(size, frame, instructions)
+        done = run_batch(program, frame, steps)
+        budget.spend(done)
+        executed += done
+        if done < steps:
+            return executed
+        size = min(batch, size * 2)
+
+        if on_batch is not None:
+            on_batch(frame, executed)
+        if deadline is not None and time.monotonic() > deadline and frame.index < n:
+            raise LimitExceeded('timeout', budget.executed, instructions[frame.index].offset, frame)
+
+    return executed
+
+
+class Suspend(Exception):
+    """
+    Raised by AsyncIO.input to leave the loop until the line is read. CALL removes its arguments only after
+    the call returns, so the loop goes one instruction back and dispatches the same call again
+    """
+
+    def __init__(self, prompt: str):
+        super().__init__(prompt)
+        self.prompt = prompt
+        self.executed = 0  # set by run_batch
+
+
+class AsyncIO:
+    """
+    input and print of one asynchronous emulation. print only collects the text, the loop hands it
+    to the print hook between batches. input suspends the loop until the input hook returns the line
+    """
+
+    def __init__(self, input_hook, print_hook):
+        """
+        :param input_hook: awaited as input_hook(prompt), returns the line without the newline
+        :param print_hook: awaited as print_hook(text) with everything printed since the last call
+        """
+        self.input_hook = input_hook
+        self.print_hook = print_hook
+        self.printed: list[str] = []
+        self.line = UNBOUND  # read line for the dispatched again call of input
+        self.nested = 0  # depth of the emulated function calls, the loop can't be left from inside them
+
+    def input(self, prompt: str = '') -> str:
+        if self.line is not UNBOUND:
+            line, self.line = self.line, UNBOUND
+            return line
+        if self.nested:
+            raise RuntimeError('input() can only be called by the emulated code itself, not by functions it made')
+        raise Suspend(str(prompt))
+
+    def print(self, *args, sep: str = ' ', end: str = '\n', file=None, flush: bool = False):
+        if file is not None:
+            builtins.print(*args, sep=sep, end=end, file=file, flush=flush)
+            return
+        self.printed.append((' ' if sep is None else sep).join(map(str, args)) + ('\n' if end is None else end))
+
+    async def flush(self):
+        if self.printed:
+            text = ''.join(self.printed)
+            self.printed.clear()
+            await self.print_hook(text)
+
+
+async def read_line(prompt: str) -> str:
+    """
+    Default input hook, stdin is read by the default executor of the loop
+    """
+    sys.stdout.write(prompt)
+    sys.stdout.flush()
+    line = await asyncio.get_running_loop().run_in_executor(None, sys.stdin.readline)
+    if not line:
+        raise EOFError('EOF when reading a line')
+    return line.rstrip('\n')
+
+
+async def write(text: str):
+    """
+    Default print hook
+    """
+    sys.stdout.write(text)
+
+
+async def emulate_async(bytecode: dis.Bytecode, input=None, print=None, batch: int = 1000,
+                        max_instructions: int = None, timeout: float = None, fuse: bool = False) -> int:
+    """
+    Emulates the code as a coroutine which gives control back to the event loop every batch instructions
+    and while the input hook waits for a line, so one event loop can run many emulations at once.
+    input and print of the emulated code go to the hooks when they are the builtins, not something
+    the module of the code defines. Calls of emulated functions run to completion without yielding
+    :param bytecode: bytecode from dis, function or code object
+    :param input: input hook, see AsyncIO, reads stdin by default
+    :param print: print hook, see AsyncIO, writes to stdout by default
+    :param max_instructions: raise LimitExceeded after executing that many instructions,
+        the code and all calls of emulated functions share them
+    :param timeout: raise LimitExceeded after running that many seconds, time spent waiting for input included
+    :return: number of executed instructions of the code itself
+    """
+    program, instructions, _ = compile_code(get_ir(bytecode).code, fuse)  # decoded once for all emulations
+    frame = Frame.new(bytecode)
+    frame.fuse = fuse
+    io = AsyncIO(input or read_line, print or write)
+    frame.globals.update({name: getattr(io, name) for name in ('input', 'print')
+                          if frame.globals.lookup(name)[1] is getattr(builtins, name)})
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    budget = Budget(max_instructions)
+
+    def runner(function: Function, frame: Frame):
+        io.nested += 1
+        try:
+            if max_instructions is None and deadline is None:
+                run(function.program, frame)
+            else:
+                run_limited(function.program, frame, function.instructions, budget, deadline)
+        finally:
+            io.nested -= 1
+
+    frame.runner = runner
+    n = len(program)
+    executed = 0
+    try:
+        while frame.index < n:
+            steps = budget.take(batch, frame, instructions)
+            try:
+                done = run_batch(program, frame, steps)
+                budget.spend(done)
+                executed += done
+            except Suspend as suspend:
+                budget.spend(suspend.executed)
+                executed += suspend.executed
+                frame.index -= 1
+                await io.flush()
+                io.line = await io.input_hook(suspend.prompt)
+            else:
+                await io.flush()
+                await asyncio.sleep(0)
+
+            if deadline is not None and time.monotonic() > deadline and frame.index < n:
+                raise LimitExceeded('timeout', budget.executed, instructions[frame.index].offset, frame)
+    except Exception:
+        await io.flush()  # whatever was printed before the error
+        raise
+
+    await io.flush()
+    return executed
+
+
+def emulate_legacy(bytecode: dis.Bytecode):
+    """
+    Old loop which creates an instruction object for every executed instruction,
+    kept to compare the decoded loop against it
+    """
     stack = []
     co_varnames = dict()
 
@@ -14,7 +657,7 @@ def emulate(bytecode: dis.Bytecode):
     instructions = []
 
     # get all instructions, cuz we need to jump around and I don't understand how to do that without a list
-    for instr in bytecode:
+    for instr in get_ir(bytecode).instructions:
         # stupid way of padding weird offset, currently there is a situation
         # when previous instruction's offset is 8 and next is 32
         while len(instructions) and instructions[-1].offset < instr.offset - 2:
@@ -39,6 +682,47 @@ def emulate(bytecode: dis.Bytecode):
         co_varnames = instruction.co_varnames
 
 
+def emulate(bytecode: dis.Bytecode, profile: bool = False, callback=None,
+            max_instructions: int = None, timeout: float = None, on_batch=None, fuse: bool = False) -> Profile | None:
+    """
+    :param bytecode: bytecode from dis, function or code object
+    :param profile: count executions and time of every instruction
+    :param callback: called as callback(instr, frame, ns) after every instruction, enables profiling
+    :param max_instructions: raise LimitExceeded after executing that many instructions,
+        the code and all calls of emulated functions share them
+    :param timeout: raise LimitExceeded after running that many seconds, shared by all calls
+    :param on_batch: called as on_batch(frame, executed) every few thousands instructions, see run_limited
+    :return: Profile if profiling was enabled, only instructions of the code itself are measured
+        and calls of emulated functions are counted as a single CALL
+    :param fuse: run the peephole pass which fuses common pairs of instructions into superinstructions,
+        a superinstruction counts as one instruction
+    """
+    program = decode(bytecode, fuse)
+    frame = Frame.new(bytecode)
+    frame.fuse = fuse
+    limited = max_instructions is not None or timeout is not None or on_batch is not None
+    if limited and (profile or callback is not None):
+        raise ValueError('Profiling and limits can not be used together')
+
+    if limited:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        budget = Budget(max_instructions)
+
+        def runner(function: Function, frame: Frame):
+            run_limited(function.program, frame, function.instructions, budget, deadline, on_batch=on_batch)
+
+        frame.runner = runner
+        run_limited(program, frame, vm_instructions(bytecode, fuse)[0], budget, deadline, on_batch=on_batch)
+        return None
+    if not profile and callback is None:
+        run(program, frame)
+        return None
+
+    stats = Profile(vm_instructions(bytecode, fuse)[0], program)
+    run_profiled(program, frame, stats, callback)
+    return stats
+
+
 if __name__ == '__main__':
     from samples.simple_game import main as sample
     dis.dis(sample)